@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from algosdk import encoding
+from algosdk.abi import ABIReferenceType, Method
+from beaker.application import get_method_spec
+
+from algorand.contract import NFTP, index_name
+from algorand.storage_accounts import StorageAccounts
+from algorand.transport import AsyncAlgodClient, EventLoopThread
+
+
+@dataclass
+class RoundChanges:
+    """what other writers did to one app in a round
+
+    `names` are the index keys whose FileEntry may have changed and
+    `blocks` the (file id, idx) of storage accounts written, opted in or
+    closed out. `listing` is set whenever global state or an index account
+    changed. `everything` means rounds were missed and nothing is known
+    """
+
+    names: set[bytes] = field(default_factory=set)
+    blocks: set[tuple[bytes, int]] = field(default_factory=set)
+    listing: bool = False
+    everything: bool = False
+
+    def __bool__(self) -> bool:
+        return bool(self.names or self.blocks or self.listing or self.everything)
+
+
+class ChainWatcher:
+    """follows rounds and tells `on_change` what each one did to an NFTP app
+
+    a task on the io loop waits on status_after_block for the next round,
+    reads the blocks it missed and picks out the calls to the app, their
+    abi args say which files and blocks they touched. Transactions carrying
+    `note` are ours and skipped, we already know what they did.
+
+    `on_change` runs on the loop's executor rather than the loop itself, so
+    it can take locks held by threads waiting on the loop. If a block cant be
+    read it is told `everything` changed and the watcher starts over from
+    the latest round. `on_following` is told, the same way, whenever the
+    watcher starts or stops following rounds, it isnt until the first status
+    read comes back
+    """
+
+    def __init__(
+        self,
+        client: AsyncAlgodClient,
+        io: EventLoopThread,
+        app_id: int,
+        accounts: StorageAccounts,
+        on_change: Callable[[RoundChanges], None],
+        on_following: Callable[[bool], None],
+        note: bytes,
+    ):
+        self.client = client
+        self.io = io
+        self.app_id = app_id
+        self.accounts = accounts
+        self.on_change = on_change
+        self.on_following = on_following
+        self.note = note
+        self.last_round = 0
+
+        self.methods: dict[bytes, Method] = {}
+        for name in NFTP().methods:
+            spec = get_method_spec(getattr(NFTP, name))
+            self.methods[spec.get_selector()] = spec
+
+        # the loop only holds tasks weakly, same as SubmitPipeline.confirming
+        self.watching = io.submit(self._watch_loop())
+
+    async def _watch_loop(self):
+        loop = asyncio.get_running_loop()
+        following = False
+        while True:
+            try:
+                if not following:
+                    self.last_round = (await self.client.status())["last-round"]
+                    following = True
+                    await loop.run_in_executor(None, self.on_following, True)
+                status = await self.client.status_after_block(self.last_round)
+                latest = status["last-round"]
+                rounds = range(self.last_round + 1, latest + 1)
+                blocks = await asyncio.gather(
+                    *(self.client.block_info(rnd) for rnd in rounds)
+                )
+                for block in blocks:
+                    changes = self._changes(block.get("block", {}))
+                    if changes:
+                        await loop.run_in_executor(None, self.on_change, changes)
+                self.last_round = latest
+            except Exception as e:
+                logging.error(f"error watching rounds after {self.last_round}: {e}")
+                if following:
+                    following = False
+                    await loop.run_in_executor(None, self.on_following, False)
+                    await loop.run_in_executor(
+                        None, self.on_change, RoundChanges(everything=True)
+                    )
+                await asyncio.sleep(1)
+
+    def _changes(self, block: dict) -> RoundChanges:
+        changes = RoundChanges()
+        for stxn in block.get("txns", []):
+            txn = stxn.get("txn", {})
+            if txn.get("type") != "appl" or txn.get("apid") != self.app_id:
+                continue
+            if base64.b64decode(txn.get("note", "")) == self.note:
+                continue
+
+            app_args = [base64.b64decode(arg) for arg in txn.get("apaa", [])]
+            method = self.methods.get(app_args[0]) if app_args else None
+            if method is None:
+                continue
+            # account args index the sender then the foreign accounts
+            accounts = [txn["snd"]] + txn.get("apat", [])
+            args: dict[str, Any] = {}
+            for arg, raw in zip(method.args, app_args[1:]):
+                if arg.type == ABIReferenceType.ACCOUNT:
+                    args[arg.name] = accounts[raw[0]]
+                else:
+                    args[arg.name] = arg.type.decode(raw)
+            self._call_changes(args, accounts, changes)
+        return changes
+
+    def _call_changes(
+        self, args: dict[str, Any], accounts: list[str], changes: RoundChanges
+    ):
+        """what one call to the app changed, from its args"""
+        for arg in ("fname", "old", "new"):
+            if args.get(arg):
+                changes.names.add(bytes(args[arg]))
+                changes.listing = True
+
+        if "deets" in args:
+            file_id, idx = bytes(args["deets"][0]), args["deets"][1]
+            if file_id == index_name:
+                # a shard opened
+                changes.listing = True
+            else:
+                changes.blocks.add((file_id, idx))
+
+        for acct_idx, _, _ in args.get("writes", []):
+            block = self.accounts.block_of(accounts[acct_idx])
+            # a block we never derived the address of cant be cached either
+            if block is not None:
+                changes.blocks.add(block)
@@ -1,8 +1,58 @@
 from typing import Literal, cast
 from beaker import *
+from beaker.lib.storage.blob import blob_page_size
 from pyteal import *
 
 storage_size = 1024
+# local state is 16 keys of 127 bytes, the blob gets all but the one for deets
+# and one index accounts need declared for their entries
+max_storage_size = 14 * blob_page_size
+
+# the first files are listed in global state, the rest in index accounts.
+# Those are FileBlocks for index_name and a shard, their local state maps file
+# names to FileEntrys. A name goes in the shard its hash picks, or the next
+# one along once thats full
+index_name = bytes(32)
+# names are listed under their path, "/" and all, so they cant clash with the
+# other keys. A key gets at most 64 bytes
+max_name_size = 63
+index_shards = 512
+# global state is 64 keys, two go to the shard bitmaps
+app_slots = 62
+# an index account keeps one of its keys for deets
+shard_slots = 15
+
+
+def file_entry(
+    length: Expr, extent: Expr, stored: Expr, file_id: Expr, generation: Expr
+) -> Expr:
+    """a FileEntry, built by hand since its all static"""
+    return Concat(Itob(length), Itob(extent), Itob(stored), file_id, Itob(generation))
+
+
+def file_length(entry: Expr) -> Expr:
+    return ExtractUint64(entry, Int(0))
+
+
+def file_extent(entry: Expr) -> Expr:
+    return ExtractUint64(entry, Int(8))
+
+
+def file_stored(entry: Expr) -> Expr:
+    return ExtractUint64(entry, Int(16))
+
+
+def file_id(entry: Expr) -> Expr:
+    return Extract(entry, Int(24), Int(32))
+
+
+def file_generation(entry: Expr) -> Expr:
+    return ExtractUint64(entry, Int(56))
+
+
+def home_shard(fname: Expr) -> Expr:
+    """the shard a name goes in unless its full"""
+    return ExtractUint16(Sha512_256(fname), Int(0)) % Int(index_shards)
 
 
 class FileBlock(LogicSignature):
@@ -13,7 +63,7 @@ class FileBlock(LogicSignature):
     and rekeying it to something else
     """
 
-    fname = TemplateVariable(TealType.bytes)
+    file_id = TemplateVariable(TealType.bytes)
     idx = TemplateVariable(TealType.uint64)
     z_app_id = TemplateVariable(TealType.uint64)
 
@@ -22,50 +72,234 @@ class FileBlock(LogicSignature):
 
 
 class FileBlockDetails(abi.NamedTuple):
-    fname: abi.Field[abi.StaticBytes[Literal[32]]]
+    file_id: abi.Field[abi.StaticBytes[Literal[32]]]
     idx: abi.Field[abi.Uint64]
 
 
+class PageWrite(abi.NamedTuple):
+    """one whole page of a storage account's blob, account indexes Txn.accounts"""
+
+    account: abi.Field[abi.Uint8]
+    page: abi.Field[abi.Uint8]
+    data: abi.Field[abi.StaticBytes[Literal[127]]]
+
+
+class FileEntry(abi.NamedTuple):
+    """what the listing keeps for each file
+
+    length is in bytes. extent is one past the highest block that has ever
+    had a storage account and stored is how many blocks have one now, blocks
+    without one are holes that read as zeros so sparse files dont pay for the
+    empty parts. file_id picks the storage accounts, it stays with the file
+    when its renamed. generation goes up with every write to a block and
+    every block opted in or closed out, so blocks cached from before still
+    hold as long as it hasnt moved. At 64 bytes the entry fills what a key
+    of the longest name leaves
+    """
+
+    length: abi.Field[abi.Uint64]
+    extent: abi.Field[abi.Uint64]
+    stored: abi.Field[abi.Uint64]
+    file_id: abi.Field[abi.StaticBytes[Literal[32]]]
+    generation: abi.Field[abi.Uint64]
+
+
 class NFTP(Application):
     files: DynamicApplicationStateValue = DynamicApplicationStateValue(
-        TealType.uint64, max_keys=64
+        TealType.bytes, max_keys=app_slots, descr="File path to its FileEntry"
+    )
+    shards: ApplicationStateValue = ApplicationStateValue(
+        TealType.bytes,
+        default=Bytes(bytes(index_shards // 8)),
+        descr="Bit per index account thats opted in",
+    )
+    overflowed: ApplicationStateValue = ApplicationStateValue(
+        TealType.bytes,
+        default=Bytes(bytes(index_shards // 8)),
+        descr="Bit per index account a name has been put past",
     )
 
     data: AccountStateBlob = AccountStateBlob(keys=9)
     deets: AccountStateValue = AccountStateValue(
-        TealType.bytes, descr="Stores a tuple of name && idx for easier lookup"
+        TealType.bytes, descr="Stores a tuple of file id && idx for easier lookup"
+    )
+    entries: DynamicAccountStateValue = DynamicAccountStateValue(
+        TealType.bytes,
+        max_keys=6,
+        descr="File path to its FileEntry, on index accounts",
     )
 
     tmpl_account: Precompile = Precompile(FileBlock(version=6).program)
 
+    def __init__(self, block_size: int = storage_size, **kwargs):
+        """block_size is how many bytes of a file each storage account holds"""
+        assert 0 < block_size <= max_storage_size, f"bad block size {block_size}"
+        self.block_size = block_size
+        # beaker finds state through the instance, this sizes the local schema
+        self.pages = pages = -(-block_size // blob_page_size)
+        self.data = AccountStateBlob(keys=pages)
+        # index accounts share the local schema, these are the keys they use
+        # past what a storage account declares
+        self.entries = DynamicAccountStateValue(
+            TealType.bytes, max_keys=shard_slots - pages
+        )
+        super().__init__(**kwargs)
+
+    @create
+    def create(self):
+        return Seq(self.initialize_application_state(), Approve())
+
     @opt_in
-    def opt_in(self, deets: FileBlockDetails):
-        """Opt File Block storage account into app"""
-        fname = ScratchVar(TealType.bytes)
+    def opt_in(
+        self, deets: FileBlockDetails, fname: abi.DynamicBytes, listing: abi.Account
+    ):
+        """Opt File Block storage account into app and list it in index
+
+        listing is the app for files listed in global state, otherwise their
+        index account. A file thats listed already has to be the one the block
+        belongs to. Index accounts opt in here too, under index_name and
+        listing themselves, fname is left empty
+        """
+        block_file = ScratchVar(TealType.bytes)
+        idx = ScratchVar(TealType.uint64)
+        entry = ScratchVar(TealType.bytes)
         return Seq(
             self.check_assert_correct_account(deets, Txn.sender()),
             Assert(
                 Txn.rekey_to() == self.address, comment="Must have rekey to app address"
             ),
-            self.data.initialize(),
             self.deets.set(deets.encode()),
-            # Update local listing
-            deets.fname.use(lambda x: fname.store(x.get())),
-            self.files[fname.load()].increment(),
+            deets.file_id.use(lambda x: block_file.store(x.get())),
+            deets.idx.use(lambda x: idx.store(x.get())),
+            If(block_file.load() == Bytes(index_name))
+            .Then(
+                Assert(idx.load() < Int(index_shards), comment="Must be a shard"),
+                self.shards.set(SetBit(self.shards.get(), idx.load(), Int(1))),
+            )
+            .Else(
+                self.data.initialize(),
+                # Update listing, the file reaches at least this block
+                entry.store(self.get_entry(listing.address(), fname.get())),
+                If(
+                    Len(entry.load()) == Int(0),
+                    Seq(
+                        self.list_new(listing.address(), fname.get()),
+                        entry.store(
+                            file_entry(
+                                Int(0), Int(0), Int(0), block_file.load(), Int(0)
+                            )
+                        ),
+                    ),
+                ),
+                Assert(
+                    file_id(entry.load()) == block_file.load(),
+                    comment="Must be a block of the file listed",
+                ),
+                self.put_entry(
+                    listing.address(),
+                    fname.get(),
+                    file_entry(
+                        file_length(entry.load()),
+                        If(
+                            idx.load() + Int(1) > file_extent(entry.load()),
+                            idx.load() + Int(1),
+                            file_extent(entry.load()),
+                        ),
+                        file_stored(entry.load()) + Int(1),
+                        block_file.load(),
+                        file_generation(entry.load()) + Int(1),
+                    ),
+                ),
+            ),
             Approve(),
         )
 
     @close_out
-    def close_out(self, deets: FileBlockDetails):
-        fname = ScratchVar(TealType.bytes)
+    def close_out(
+        self, deets: FileBlockDetails, fname: abi.DynamicBytes, listing: abi.Account
+    ):
+        """a block of a file renamed over is no longer listed, it just goes"""
+        block_file = ScratchVar(TealType.bytes)
+        entry = ScratchVar(TealType.bytes)
         return Seq(
-            deets.fname.use(lambda x: fname.store(x.get())),
-            self.files[fname.load()].decrement(),
-            # Last block for this file, delete it
-            If(self.files[fname.load()] == Int(0), self.files[fname.load()].delete()),
+            deets.file_id.use(lambda x: block_file.store(x.get())),
+            entry.store(self.get_entry(listing.address(), fname.get())),
+            If(
+                And(
+                    Len(entry.load()) > Int(0),
+                    file_id(entry.load()) == block_file.load(),
+                ),
+                # Last block for this file, delete it
+                If(
+                    file_stored(entry.load()) == Int(1),
+                    self.delete_entry(listing.address(), fname.get()),
+                    self.put_entry(
+                        listing.address(),
+                        fname.get(),
+                        file_entry(
+                            file_length(entry.load()),
+                            file_extent(entry.load()),
+                            file_stored(entry.load()) - Int(1),
+                            block_file.load(),
+                            file_generation(entry.load()) + Int(1),
+                        ),
+                    ),
+                ),
+            ),
             Approve(),
         )
 
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def resize(
+        self,
+        fname: abi.DynamicBytes,
+        length: abi.Uint64,
+        listing: abi.Account,
+    ):
+        """set the length of a file in bytes, blocks past the end are left alone"""
+        entry = ScratchVar(TealType.bytes)
+        return Seq(
+            entry.store(self.get_entry(listing.address(), fname.get())),
+            Assert(Len(entry.load()) > Int(0), comment="Must be listed in index"),
+            self.put_entry(
+                listing.address(),
+                fname.get(),
+                file_entry(
+                    length.get(),
+                    file_extent(entry.load()),
+                    file_stored(entry.load()),
+                    file_id(entry.load()),
+                    file_generation(entry.load()),
+                ),
+            ),
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def rename(
+        self,
+        old: abi.DynamicBytes,
+        new: abi.DynamicBytes,
+        old_listing: abi.Account,
+        new_listing: abi.Account,
+    ):
+        """list the file at old under new instead, replacing whatever new was
+
+        the entry keeps its file id so the blocks stay where they are. Those
+        of a file replaced are left for the creator to close out
+        """
+        entry = ScratchVar(TealType.bytes)
+        return Seq(
+            entry.store(self.get_entry(old_listing.address(), old.get())),
+            Assert(Len(entry.load()) > Int(0), comment="Must be listed in index"),
+            If(
+                Len(self.get_entry(new_listing.address(), new.get())) == Int(0),
+                self.list_new(new_listing.address(), new.get()),
+            ),
+            # out first, so a full shard can take the name it gave up
+            self.delete_entry(old_listing.address(), old.get()),
+            self.put_entry(new_listing.address(), new.get(), entry.load()),
+        )
+
     @external(authorize=Authorize.only(Global.creator_address()))
     def delete(self, deets: FileBlockDetails, storage_account: abi.Account):
         """rekey account back and"""
@@ -75,16 +309,143 @@ class NFTP(Application):
         )
 
     @external(authorize=Authorize.only(Global.creator_address()))
-    def write(
+    def write_range(
         self,
         deets: FileBlockDetails,
-        data: abi.StaticBytes[Literal[1024]],
+        start: abi.Uint16,
+        data: abi.DynamicBytes,
         storage_account: abi.Account,
+        fname: abi.DynamicBytes,
+        listing: abi.Account,
     ):
-        """write data to account blob"""
+        """write data into the account blob at start, leaving the rest of it alone"""
         return Seq(
-            # self.check_assert_correct_account(deets, storage_account.address()),
-            self.data[storage_account.address()].write(Int(0), data.get()),
+            Assert(
+                start.get() + data.length() <= Int(self.block_size),
+                comment="Must stay inside the block",
+            ),
+            self.data[storage_account.address()].write(start.get(), data.get()),
+            self.bump_generation(listing.address(), fname.get()),
+        )
+
+    @external(authorize=Authorize.only(Global.creator_address()))
+    def write_pages(
+        self,
+        writes: abi.DynamicArray[PageWrite],
+        fname: abi.DynamicBytes,
+        listing: abi.Account,
+    ):
+        """write whole blob pages of several accounts of one file
+
+        pages are put straight into the account's local state, the blob keeps
+        page i under key i. That costs ~35 ops a page where write pays ~60 to
+        splice arbitrary ranges, so a call can fill its args with pages from a
+        couple of blocks and stay inside its opcode budget
+        """
+        # PageWrite is static, so walk the encoded array rather than decode
+        # each one into scratch, past the uint16 length prefix
+        pos = ScratchVar(TealType.uint64)
+        size = PageWrite().type_spec().byte_length_static()
+        return Seq(
+            For(
+                pos.store(Int(2)),
+                pos.load() < Len(writes.encode()),
+                pos.store(pos.load() + Int(size)),
+            ).Do(
+                Assert(
+                    GetByte(writes.encode(), pos.load() + Int(1)) < Int(self.pages),
+                    comment="Must be in the blob",
+                ),
+                App.localPut(
+                    Txn.accounts[GetByte(writes.encode(), pos.load())],
+                    # the blob keys are the single bytes 0..pages-1, so the
+                    # encoded page byte is the key itself
+                    Extract(writes.encode(), pos.load() + Int(1), Int(1)),
+                    Extract(writes.encode(), pos.load() + Int(2), Int(size - 2)),
+                ),
+            ),
+            self.bump_generation(listing.address(), fname.get()),
+        )
+
+    def get_entry(self, index: Expr, fname: Expr):
+        """the FileEntry listed for fname in index, empty if there isnt one"""
+        entry = ScratchVar(TealType.bytes)
+        return Seq(
+            If(index == self.address)
+            .Then(
+                (listed := self.files[fname].get_maybe()),
+                entry.store(If(listed.hasValue(), listed.value(), Bytes(""))),
+            )
+            .Else(
+                (sharded := self.entries[fname][index].get_maybe()),
+                entry.store(If(sharded.hasValue(), sharded.value(), Bytes(""))),
+            ),
+            entry.load(),
+        )
+
+    def put_entry(self, index: Expr, fname: Expr, entry: Expr):
+        return If(
+            index == self.address,
+            self.files[fname].set(entry),
+            Seq(Pop(self.index_shard(index)), self.entries[fname][index].set(entry)),
+        )
+
+    def delete_entry(self, index: Expr, fname: Expr):
+        return If(
+            index == self.address,
+            self.files[fname].delete(),
+            Seq(Pop(self.index_shard(index)), self.entries[fname][index].delete()),
+        )
+
+    def bump_generation(self, index: Expr, fname: Expr):
+        """a block of fname changed, unless its gone from the listing"""
+        entry = ScratchVar(TealType.bytes)
+        return Seq(
+            entry.store(self.get_entry(index, fname)),
+            If(
+                Len(entry.load()) > Int(0),
+                self.put_entry(
+                    index,
+                    fname,
+                    file_entry(
+                        file_length(entry.load()),
+                        file_extent(entry.load()),
+                        file_stored(entry.load()),
+                        file_id(entry.load()),
+                        file_generation(entry.load()) + Int(1),
+                    ),
+                ),
+            ),
+        )
+
+    def list_new(self, index: Expr, fname: Expr):
+        """flag the shards a new name went past so lookups know to keep going"""
+        shard = ScratchVar(TealType.uint64)
+        i = ScratchVar(TealType.uint64)
+        return If(
+            index != self.address,
+            Seq(
+                shard.store(self.index_shard(index)),
+                For(
+                    i.store(home_shard(fname)),
+                    i.load() != shard.load(),
+                    i.store((i.load() + Int(1)) % Int(index_shards)),
+                ).Do(
+                    self.overflowed.set(SetBit(self.overflowed.get(), i.load(), Int(1)))
+                ),
+            ),
+        )
+
+    def index_shard(self, index: Expr):
+        """the shard of an index account, failing for any other account"""
+        deets = ScratchVar(TealType.bytes)
+        return Seq(
+            deets.store(self.deets[index].get()),
+            Assert(
+                Extract(deets.load(), Int(0), Int(32)) == Bytes(index_name),
+                comment="Must be an index account",
+            ),
+            ExtractUint64(deets.load(), Int(32)),
         )
 
     @internal(TealType.none)
@@ -101,14 +462,14 @@ class NFTP(Application):
     @internal(TealType.none)
     def check_assert_correct_account(self, deets: FileBlockDetails, acct: Expr):
         """Assert we have the right account given the file block details"""
-        fname = ScratchVar()
+        block_file = ScratchVar()
         idx = ScratchVar()
         return Seq(
-            deets.fname.use(lambda x: fname.store(x.get())),
+            deets.file_id.use(lambda x: block_file.store(x.get())),
             deets.idx.use(lambda x: idx.store(x.get())),
             Assert(
                 self.tmpl_account.template_hash(
-                    fname.load(), idx.load(), Global.current_application_id()
+                    block_file.load(), idx.load(), Global.current_application_id()
                 )
                 == acct
             ),
@@ -0,0 +1,985 @@
+"""In-process stand-in for the algod endpoints nftp talks to
+
+FakeAlgod keeps a tiny ledger in memory and emulates the NFTP contract
+methods against it, so the real beaker ApplicationClient (and the storage
+managers built on it) can run without a sandbox. Round trip time, block time
+and failures are configurable and every request is counted, which makes it
+usable for timing FUSE operations offline.
+
+    fake = FakeAlgod(rtt=0.005, block_time=0.5)
+    app_client = fake.create_app_client()
+    manager = AlgorandStorageManager(app_client)
+
+`serve` puts the same fake behind a local HTTP server, for exercising the
+real transports in algorand/transport.py.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import random
+import struct
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+from urllib import parse
+
+import msgpack
+from algosdk import account, encoding, logic
+from algosdk.abi import ABIReferenceType, Method
+from algosdk.atomic_transaction_composer import AccountTransactionSigner
+from algosdk.error import AlgodHTTPError
+from algosdk.future.transaction import OnComplete
+from algosdk.source_map import SourceMap
+from algosdk.v2client.algod import AlgodClient
+from beaker.application import get_method_spec
+from beaker.client import ApplicationClient
+from beaker.consts import algo
+from beaker.lib.storage.blob import blob_page_size
+from beaker.precompile import Precompile
+from beaker.sandbox.kmd import SandboxAccount
+
+from algorand.contract import (
+    NFTP,
+    FileBlock,
+    index_name,
+    index_shards,
+    storage_size,
+)
+from algorand.transport import AsyncAlgodClient, PooledAlgodClient
+
+
+FAKE_ALGOD_ADDRESS = "http://fake-algod"
+FAKE_ALGOD_TOKEN = "a" * 64
+
+MAX_GLOBAL_KEYS = 64
+MAX_LOCAL_KEYS = 16
+MAX_KEY_LEN = 64
+# files entries are a contract.FileEntry, length, extent and stored uint64s
+# then the file id and its generation
+FILE_ENTRY = struct.Struct(">QQQ32sQ")
+MAX_GROUP_SIZE = 16
+MIN_FEE = 1000
+# per app call limits, the consensus params MaxAppTotalArgLen and MaxAppTxnAccounts
+MAX_APP_ARGS_LEN = 2048
+MAX_APP_ACCOUNTS = 4
+# how long algod holds a status/wait-for-block-after before answering anyway
+WAIT_FOR_BLOCK_TIMEOUT = 60.0
+
+
+class FakeLedgerError(Exception):
+    """raised when a transaction would be rejected by the network"""
+
+
+@dataclass
+class FakeApp:
+    creator: str
+    global_state: dict[bytes, int | bytes] = field(default_factory=dict)
+    # NFTP(block_size), storage accounts keep it in a blob of blob_keys
+    block_size: int = storage_size
+    approval_program: bytes = b""
+
+    @property
+    def blob_keys(self) -> list[bytes]:
+        pages = -(-self.block_size // blob_page_size)
+        return [x.to_bytes(1, "big") for x in range(pages)]
+
+
+@dataclass
+class PendingGroup:
+    txids: list[str]
+    txns: list[Any]
+    confirm_round: int
+
+
+def assemble(teal: str) -> tuple[bytes, str]:
+    """assemble the handful of opcodes FileBlock compiles down to
+
+    returns the program bytes and a source map `mappings` string. Anything we
+    dont understand gets an opaque (but stable) program so that approval
+    programs can still be "compiled" by ApplicationClient.build
+    """
+    program = b""
+    pc_lines: dict[int, int] = {}
+    try:
+        for line_no, line in enumerate(teal.splitlines()):
+            line = line.split("//")[0].strip()
+            if not line:
+                continue
+            op, *imm = line.split(" ")
+            pc_lines[len(program)] = line_no
+            match op:
+                case "#pragma":
+                    program += _uvarint(int(imm[1]))
+                case "pushbytes":
+                    val = imm[0]
+                    if val.startswith("0x"):
+                        raw = bytes.fromhex(val[2:])
+                    else:
+                        raw = val.strip('"').encode()
+                    program += b"\x80" + _uvarint(len(raw)) + raw
+                case "pushint":
+                    program += b"\x81" + _uvarint(int(imm[0]))
+                case "store":
+                    program += b"\x35" + bytes([int(imm[0])])
+                case "load":
+                    program += b"\x34" + bytes([int(imm[0])])
+                case "return":
+                    program += b"\x43"
+                case _:
+                    raise ValueError(op)
+    except (ValueError, IndexError):
+        version = int(teal.splitlines()[0].split(" ")[-1])
+        return _uvarint(version) + hashlib.sha256(teal.encode()).digest(), "AAAA"
+
+    mappings, last_line = [], 0
+    for pc in range(len(program)):
+        if pc in pc_lines:
+            mappings.append("AA" + _vlq(pc_lines[pc] - last_line) + "A")
+            last_line = pc_lines[pc]
+        else:
+            mappings.append("")
+    return program, ";".join(mappings)
+
+
+def _uvarint(val: int) -> bytes:
+    buf = bytearray()
+    while val >= 0x80:
+        buf.append((val & 0x7F) | 0x80)
+        val >>= 7
+    buf.append(val)
+    return bytes(buf)
+
+
+_VLQ_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+
+def _vlq(val: int) -> str:
+    val = ((-val) << 1) | 1 if val < 0 else val << 1
+    out = ""
+    while True:
+        digit, val = val & 0x1F, val >> 5
+        out += _VLQ_CHARS[digit | (0x20 if val else 0)]
+        if not val:
+            return out
+
+
+class FakeAlgod:
+    """ledger + request router that answers the algod v2 api the sdk uses
+
+    rtt: seconds slept for every request
+    block_time: seconds between rounds, 0 confirms each group immediately
+        (like sandbox dev mode)
+    failure_rate: probability any request fails with an AlgodHTTPError
+    """
+
+    def __init__(
+        self,
+        rtt: float = 0.0,
+        block_time: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.rtt = rtt
+        self.block_time = block_time
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+        # request name -> number of upcoming requests of that kind to fail
+        self.failures: Counter[str] = Counter()
+        # request name -> number of requests served
+        self.requests: Counter[str] = Counter()
+        # transaction kind (pay, appl, or the abi method name) -> count
+        self.txns: Counter[str] = Counter()
+
+        self.lock = threading.RLock()
+        # notified whenever the round moves on
+        self.new_round = threading.Condition(self.lock)
+
+        self.round = 1
+        self.genesis = time.monotonic()
+        self.balances: dict[str, int] = {}
+        self.auth: dict[str, str] = {}
+        self.apps: dict[int, FakeApp] = {}
+        self.local_state: dict[tuple[str, int], dict[bytes, int | bytes]] = {}
+        self.pending: list[PendingGroup] = []
+        self.confirmed: dict[str, dict[str, Any]] = {}
+        # round -> the transactions applied in it, as algod's json blocks show them
+        self.blocks: dict[int, list[dict]] = {}
+        self._next_app_id = 1
+        self._journal: Optional[list[Callable[[], None]]] = None
+        self.server: Optional[ThreadingHTTPServer] = None
+
+        self.app = NFTP()
+        self.methods: dict[bytes, tuple[Method, Callable]] = {}
+        for name in self.app.methods:
+            spec = get_method_spec(getattr(NFTP, name))
+            self.methods[spec.get_selector()] = (spec, getattr(self, f"_nftp_{name}"))
+
+        self.tmpl_account = Precompile(FileBlock(version=6).program)
+        binary, mappings = assemble(self.tmpl_account.program)
+        self.tmpl_account._set_compiled(
+            binary, logic.address(binary), SourceMap(_source_map(mappings))
+        )
+        self._tmpl_addrs: dict[tuple[bytes, int, int], str] = {}
+
+        self.accounts: list[SandboxAccount] = []
+        for _ in range(3):
+            sk, addr = account.generate_account()
+            self.balances[addr] = 1_000_000 * algo
+            self.accounts.append(SandboxAccount(addr, sk, AccountTransactionSigner(sk)))
+
+    def get_accounts(self) -> list[SandboxAccount]:
+        return list(self.accounts)
+
+    def get_algod_client(self) -> AlgodClient:
+        if self.server is not None:
+            host, port = self.server.server_address[:2]
+            return PooledAlgodClient(FAKE_ALGOD_TOKEN, f"http://{host}:{port}")
+        return FakeAlgodClient(self)
+
+    def create_app_client(self, block_size: int = storage_size) -> ApplicationClient:
+        """create and fund a fresh NFTP app, returning a client for it"""
+        acct = self.get_accounts().pop()
+        app_client = ApplicationClient(
+            self.get_algod_client(), NFTP(block_size=block_size), signer=acct.signer
+        )
+        app_client.create()
+        with self.lock:
+            self.apps[app_client.app_id].block_size = block_size
+        app_client.fund(algo * 2)
+        return app_client
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """answer requests over HTTP on a background thread, returns the address
+
+        clients from get_algod_client talk to it over the wire from then on
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out in separate writes, dont let them sit
+            # behind a delayed ack on a kept alive connection
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._serve()
+
+            def do_POST(self):
+                self._serve()
+
+            def _serve(self):
+                url = parse.urlsplit(self.path)
+                path = url.path.removeprefix("/v2")
+                params = dict(parse.parse_qsl(url.query))
+                data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    status = 200
+                    body = fake.request(self.command, path, params, data or None)
+                except AlgodHTTPError as e:
+                    status = e.code or 500
+                    body = {"message": str(e)}
+
+                out = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, format, *args):
+                logging.debug(f"fake algod http: {format % args}")
+
+        class Server(ThreadingHTTPServer):
+            # pools open a burst of connections at once, the default backlog
+            # of 5 drops the rest and they sit out a second long syn retry
+            request_queue_size = 128
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        threading.Thread(
+            target=self.server.serve_forever, name="fake-algod-http", daemon=True
+        ).start()
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def fail_next(self, name: str, count: int = 1):
+        """make the next `count` requests named `name` (e.g. send, account_info) fail"""
+        with self.lock:
+            self.failures[name] += count
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests.clear()
+            self.txns.clear()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict] = None,
+        data: Optional[bytes] = None,
+    ) -> Any:
+        """serve a single algod request, sleeping for rtt first"""
+        name, handler, args = self._route(method, path)
+
+        with self.lock:
+            self.requests[name] += 1
+            fail = self.failures[name] > 0 or (
+                self.failure_rate > 0 and self.random.random() < self.failure_rate
+            )
+            if self.failures[name] > 0:
+                self.failures[name] -= 1
+
+        if self.rtt > 0:
+            time.sleep(self.rtt)
+
+        if fail:
+            raise AlgodHTTPError(f"injected failure for {name}", 500)
+
+        return handler(*args, params=params or {}, data=data)
+
+    def _route(self, method: str, path: str) -> tuple[str, Callable, list[str]]:
+        parts = path.strip("/").split("/")
+        match method, parts:
+            case "GET", ["status"]:
+                return "status", self._status, []
+            case "GET", ["status", "wait-for-block-after", rnd]:
+                return "status_after_block", self._status_after_block, [rnd]
+            case "GET", ["blocks", rnd]:
+                return "block_info", self._block_info, [rnd]
+            case "GET", ["transactions", "params"]:
+                return "suggested_params", self._suggested_params, []
+            case "POST", ["transactions"]:
+                return "send", self._send, []
+            case "GET", ["transactions", "pending", txid]:
+                return "pending", self._pending_info, [txid]
+            case "GET", ["accounts", addr]:
+                return "account_info", self._account_info, [addr]
+            case "GET", ["accounts", addr, "applications", app_id]:
+                return (
+                    "account_application_info",
+                    self._account_app_info,
+                    [
+                        addr,
+                        app_id,
+                    ],
+                )
+            case "GET", ["applications", app_id]:
+                return "application_info", self._application_info, [app_id]
+            case "POST", ["teal", "compile"]:
+                return "compile", self._compile, []
+        raise AlgodHTTPError(f"fake algod cant serve {method} {path}", 404)
+
+    #
+    # rounds
+    #
+
+    def current_round(self) -> int:
+        with self.lock:
+            self._advance()
+            return self.round
+
+    def _advance(self):
+        """move the round forward with the wall clock and apply due groups"""
+        if self.block_time > 0:
+            elapsed = time.monotonic() - self.genesis
+            self.round = max(self.round, 1 + int(elapsed / self.block_time))
+
+        while self.pending and self.pending[0].confirm_round <= self.round:
+            self._apply_group(self.pending.pop(0))
+
+    def _status(self, params, data) -> dict:
+        return {"last-round": self.current_round(), "time-since-last-round": 0}
+
+    def _status_after_block(self, rnd: str, params, data) -> dict:
+        target = int(rnd) + 1
+        if self.block_time > 0:
+            wait = self.genesis + (target - 1) * self.block_time - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        else:
+            # dev mode, the next round comes with the next group sent
+            with self.lock:
+                self.new_round.wait_for(
+                    lambda: self.round >= target, timeout=WAIT_FOR_BLOCK_TIMEOUT
+                )
+        return self._status(params, data)
+
+    def _block_info(self, rnd: str, params, data) -> dict:
+        with self.lock:
+            if int(rnd) > self.current_round():
+                raise AlgodHTTPError(
+                    "failed to retrieve information from the ledger", 404
+                )
+            block: dict[str, Any] = {"rnd": int(rnd)}
+            if self.blocks.get(int(rnd)):
+                block["txns"] = list(self.blocks[int(rnd)])
+            return {"block": block}
+
+    def _suggested_params(self, params, data) -> dict:
+        return {
+            "fee": 0,
+            "min-fee": MIN_FEE,
+            "last-round": self.current_round(),
+            "genesis-hash": base64.b64encode(bytes(32)).decode(),
+            "genesis-id": "fake-v1",
+            "consensus-version": "future",
+        }
+
+    def _compile(self, params, data) -> dict:
+        program, mappings = assemble(data.decode())
+        result = {
+            "result": base64.b64encode(program).decode(),
+            "hash": logic.address(program),
+        }
+        if str(params.get("sourcemap")).lower() == "true":
+            result["sourcemap"] = _source_map(mappings)
+        return result
+
+    #
+    # reads
+    #
+
+    def _account_info(self, addr: str, params, data) -> dict:
+        with self.lock:
+            self._advance()
+            info = {
+                "address": addr,
+                "amount": self.balances.get(addr, 0),
+                "round": self.round,
+                "apps-local-state": [
+                    {"id": app_id, "key-value": _encode_state(kv)}
+                    for (owner, app_id), kv in self.local_state.items()
+                    if owner == addr
+                ],
+            }
+            if addr in self.auth:
+                info["auth-addr"] = self.auth[addr]
+            return info
+
+    def _account_app_info(self, addr: str, app_id: str, params, data) -> dict:
+        with self.lock:
+            self._advance()
+            kv = self.local_state.get((addr, int(app_id)))
+            if kv is None:
+                raise AlgodHTTPError("account application info not found", 404)
+            return {
+                "round": self.round,
+                "app-local-state": {"id": int(app_id), "key-value": _encode_state(kv)},
+            }
+
+    def _application_info(self, app_id: str, params, data) -> dict:
+        with self.lock:
+            self._advance()
+            app = self.apps.get(int(app_id))
+            if app is None:
+                raise AlgodHTTPError("application does not exist", 404)
+            return {
+                "id": int(app_id),
+                "params": {
+                    "creator": app.creator,
+                    "approval-program": base64.b64encode(app.approval_program).decode(),
+                    "global-state": _encode_state(app.global_state),
+                },
+            }
+
+    def _pending_info(self, txid: str, params, data) -> dict:
+        with self.lock:
+            self._advance()
+            if txid in self.confirmed:
+                return self.confirmed[txid]
+            for group in self.pending:
+                if txid in group.txids:
+                    return {"confirmed-round": 0, "pool-error": ""}
+        raise AlgodHTTPError("txn does not exist", 404)
+
+    #
+    # writes
+    #
+
+    def _send(self, params, data) -> dict:
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(data)
+        stxns = [encoding.future_msgpack_decode(d) for d in unpacker]
+        txids = [stxn.get_txid() for stxn in stxns]
+
+        with self.lock:
+            self._advance()
+            group = PendingGroup(txids, stxns, self.round + 1)
+            if self.block_time > 0:
+                self.pending.append(group)
+            else:
+                # dev mode, every group gets its own block right away
+                self.round += 1
+                self.new_round.notify_all()
+                err = self._apply_group(group)
+                if err is not None:
+                    raise AlgodHTTPError(f"transaction rejected: {err}", 400)
+
+        return {"txId": txids[0]}
+
+    def _apply_group(self, group: PendingGroup) -> Optional[str]:
+        """apply every txn in the group or none of them"""
+        self._journal = []
+        results = []
+        try:
+            if len(group.txns) > MAX_GROUP_SIZE:
+                raise FakeLedgerError(f"group of {len(group.txns)} is too large")
+            fees = sum(stxn.transaction.fee for stxn in group.txns)
+            if fees < MIN_FEE * len(group.txns):
+                raise FakeLedgerError(f"fee too small: {fees}")
+
+            for stxn in group.txns:
+                results.append(self._apply_txn(stxn))
+        except FakeLedgerError as e:
+            for undo in reversed(self._journal):
+                undo()
+            self._journal = None
+            logging.debug(f"fake algod rejected group: {e}")
+            for txid in group.txids:
+                self.confirmed[txid] = {"confirmed-round": 0, "pool-error": str(e)}
+            return str(e)
+
+        self._journal = None
+        self.blocks.setdefault(group.confirm_round, []).extend(
+            _block_txn(stxn.transaction) for stxn in group.txns
+        )
+        for txid, info in zip(group.txids, results):
+            info["confirmed-round"] = group.confirm_round
+            self.confirmed[txid] = info
+        return None
+
+    def _apply_txn(self, stxn: Any) -> dict:
+        txn = stxn.transaction
+        signer = (
+            getattr(stxn, "authorizing_address", None)
+            or getattr(stxn, "auth_addr", None)
+            or txn.sender
+        )
+        if self.auth.get(txn.sender, txn.sender) != signer:
+            raise FakeLedgerError(f"{txn.sender} is not authorized by {signer}")
+
+        self._put(self.balances, txn.sender, self.balances.get(txn.sender, 0) - txn.fee)
+
+        info: dict[str, Any] = {}
+        match txn.type:
+            case "pay":
+                self.txns["pay"] += 1
+                self._pay(txn.sender, txn.receiver, txn.amt)
+                if txn.close_remainder_to:
+                    self._pay(
+                        txn.sender, txn.close_remainder_to, self.balances[txn.sender]
+                    )
+            case "appl":
+                info = self._app_call(txn)
+            case _:
+                raise FakeLedgerError(f"unsupported txn type {txn.type}")
+
+        if txn.rekey_to is not None:
+            self._rekey(txn.sender, txn.rekey_to)
+        return info
+
+    def _app_call(self, txn: Any) -> dict:
+        if txn.index == 0:
+            self.txns["create"] += 1
+            app_id = self._next_app_id
+            self._next_app_id += 1
+            app = FakeApp(creator=txn.sender, approval_program=txn.approval_program)
+            # NFTP.create starts every shard bitmap empty
+            app.global_state[b"shards"] = bytes(index_shards // 8)
+            app.global_state[b"overflowed"] = bytes(index_shards // 8)
+            self._put(self.apps, app_id, app)
+            return {"application-index": app_id}
+
+        app = self.apps.get(txn.index)
+        if app is None:
+            raise FakeLedgerError(f"application {txn.index} does not exist")
+
+        key = (txn.sender, txn.index)
+        if txn.on_complete == OnComplete.OptInOC:
+            if key in self.local_state:
+                raise FakeLedgerError(f"{txn.sender} already opted in")
+            self._put(self.local_state, key, {})
+        elif key not in self.local_state and txn.on_complete in (
+            OnComplete.CloseOutOC,
+        ):
+            raise FakeLedgerError(f"{txn.sender} not opted in")
+
+        if sum(len(arg) for arg in txn.app_args or []) > MAX_APP_ARGS_LEN:
+            raise FakeLedgerError("app args are too long")
+        if len(txn.accounts or []) > MAX_APP_ACCOUNTS:
+            raise FakeLedgerError("too many foreign accounts")
+        if not txn.app_args or txn.app_args[0] not in self.methods:
+            raise FakeLedgerError("no matching method")
+
+        spec, handler = self.methods[txn.app_args[0]]
+        self.txns[spec.name] += 1
+
+        kwargs = {}
+        for idx, arg in enumerate(spec.args):
+            raw = txn.app_args[idx + 1]
+            if arg.type == ABIReferenceType.ACCOUNT:
+                acct_idx = raw[0]
+                kwargs[arg.name] = (
+                    txn.sender if acct_idx == 0 else txn.accounts[acct_idx - 1]
+                )
+            else:
+                kwargs[arg.name] = arg.type.decode(raw)
+
+        handler(app, txn, **kwargs)
+
+        if txn.on_complete == OnComplete.CloseOutOC:
+            self._pop(self.local_state, key)
+        return {}
+
+    def _pay(self, sender: str, receiver: str, amt: int):
+        self._put(self.balances, sender, self.balances.get(sender, 0) - amt)
+        self._put(self.balances, receiver, self.balances.get(receiver, 0) + amt)
+
+    def _rekey(self, addr: str, to: str):
+        if to == addr:
+            self._pop(self.auth, addr)
+        else:
+            self._put(self.auth, addr, to)
+
+    def _put(self, d: dict, key: Any, val: Any):
+        if self._journal is not None:
+            if key in d:
+                old = d[key]
+                self._journal.append(lambda: d.__setitem__(key, old))
+            else:
+                self._journal.append(lambda: d.pop(key, None))
+        d[key] = val
+
+    def _pop(self, d: dict, key: Any):
+        if key not in d:
+            return
+        if self._journal is not None:
+            old = d[key]
+            self._journal.append(lambda: d.__setitem__(key, old))
+        del d[key]
+
+    #
+    # NFTP contract emulation, one handler per abi method
+    #
+
+    def _storage_address(self, file_id: bytes, idx: int, app_id: int) -> str:
+        key = (file_id, idx, app_id)
+        if key not in self._tmpl_addrs:
+            self._tmpl_addrs[key] = logic.address(
+                self.tmpl_account.populate_template(file_id, idx, app_id)
+            )
+        return self._tmpl_addrs[key]
+
+    def _check_account(self, txn: Any, deets: list, addr: str):
+        file_id, idx = bytes(deets[0]), deets[1]
+        if self._storage_address(file_id, idx, txn.index) != addr:
+            raise FakeLedgerError(f"{addr} is not the storage account for {deets}")
+
+    def _check_creator(self, app: FakeApp, txn: Any):
+        if txn.sender != app.creator:
+            raise FakeLedgerError("only the creator may call this method")
+
+    def _local(self, addr: str, app_id: int) -> dict[bytes, int | bytes]:
+        kv = self.local_state.get((addr, app_id))
+        if kv is None:
+            raise FakeLedgerError(f"{addr} not opted in to {app_id}")
+        return kv
+
+    def _set_global(self, app: FakeApp, key: bytes, val: Optional[int | bytes]):
+        if val is None:
+            self._pop(app.global_state, key)
+            return
+        if len(key) > MAX_KEY_LEN:
+            raise FakeLedgerError("key too long")
+        if key not in app.global_state and len(app.global_state) >= MAX_GLOBAL_KEYS:
+            raise FakeLedgerError("store integer count exceeds schema")
+        self._put(app.global_state, key, val)
+
+    def _set_local(
+        self, kv: dict[bytes, int | bytes], key: bytes, val: Optional[bytes]
+    ):
+        if val is None:
+            self._pop(kv, key)
+            return
+        if len(key) > MAX_KEY_LEN:
+            raise FakeLedgerError("key too long")
+        if key not in kv and len(kv) >= MAX_LOCAL_KEYS:
+            raise FakeLedgerError("store bytes count exceeds schema")
+        self._put(kv, key, val)
+
+    def _blob_write(
+        self, app: FakeApp, kv: dict[bytes, int | bytes], start: int, buf: bytes
+    ):
+        blob = bytearray(b"".join(kv[k] for k in app.blob_keys))
+        if start + len(buf) > len(blob):
+            raise FakeLedgerError("write past end of blob")
+        blob[start : start + len(buf)] = buf
+        for page, k in enumerate(app.blob_keys):
+            chunk = bytes(blob[page * blob_page_size : (page + 1) * blob_page_size])
+            if kv[k] != chunk:
+                self._put(kv, k, chunk)
+
+    def _nftp_opt_in(
+        self, app: FakeApp, txn: Any, deets: list, fname: list, listing: str
+    ):
+        self._check_account(txn, deets, txn.sender)
+        if txn.rekey_to != logic.get_application_address(txn.index):
+            raise FakeLedgerError("Must have rekey to app address")
+
+        kv = self._local(txn.sender, txn.index)
+        self._put(kv, b"deets", _encode_deets(deets))
+
+        file_id, idx = bytes(deets[0]), deets[1]
+        if file_id == index_name:
+            if idx >= index_shards:
+                raise FakeLedgerError("Must be a shard")
+            self._set_bit(app, b"shards", idx)
+            return
+
+        fname = bytes(fname)
+        for k in app.blob_keys:
+            self._put(kv, k, bytes(blob_page_size))
+        entry = self._get_entry(app, txn, listing, fname)
+        if entry is None:
+            self._list_new(app, txn, listing, fname)
+            entry = (0, 0, 0, file_id, 0)
+        length, extent, stored, listed, generation = entry
+        if listed != file_id:
+            raise FakeLedgerError("Must be a block of the file listed")
+        self._put_entry(
+            app,
+            txn,
+            listing,
+            fname,
+            (length, max(extent, idx + 1), stored + 1, listed, generation + 1),
+        )
+
+    def _nftp_close_out(
+        self, app: FakeApp, txn: Any, deets: list, fname: list, listing: str
+    ):
+        file_id, fname = bytes(deets[0]), bytes(fname)
+        entry = self._get_entry(app, txn, listing, fname)
+        if entry is None or entry[3] != file_id:
+            # a block of a file renamed over, nothing lists it
+            return
+        length, extent, stored, _, generation = entry
+        self._put_entry(
+            app,
+            txn,
+            listing,
+            fname,
+            (length, extent, stored - 1, file_id, generation + 1)
+            if stored > 1
+            else None,
+        )
+
+    def _nftp_resize(
+        self, app: FakeApp, txn: Any, fname: list, length: int, listing: str
+    ):
+        self._check_creator(app, txn)
+        fname = bytes(fname)
+        entry = self._get_entry(app, txn, listing, fname)
+        if entry is None:
+            raise FakeLedgerError(f"no file {fname!r}")
+        self._put_entry(app, txn, listing, fname, (length,) + entry[1:])
+
+    def _nftp_rename(
+        self,
+        app: FakeApp,
+        txn: Any,
+        old: list,
+        new: list,
+        old_listing: str,
+        new_listing: str,
+    ):
+        self._check_creator(app, txn)
+        old, new = bytes(old), bytes(new)
+        entry = self._get_entry(app, txn, old_listing, old)
+        if entry is None:
+            raise FakeLedgerError(f"no file {old!r}")
+        if self._get_entry(app, txn, new_listing, new) is None:
+            self._list_new(app, txn, new_listing, new)
+        self._put_entry(app, txn, old_listing, old, None)
+        self._put_entry(app, txn, new_listing, new, entry)
+
+    def _bump_generation(self, app: FakeApp, txn: Any, listing: str, fname: list):
+        fname = bytes(fname)
+        entry = self._get_entry(app, txn, listing, fname)
+        if entry is not None:
+            self._put_entry(app, txn, listing, fname, entry[:4] + (entry[4] + 1,))
+
+    def _list_new(self, app: FakeApp, txn: Any, listing: str, fname: bytes):
+        """flag the shards a new name went past"""
+        shard = self._index_shard(txn, listing)
+        if shard is not None:
+            home = _home_shard(fname)
+            while home != shard:
+                self._set_bit(app, b"overflowed", home)
+                home = (home + 1) % index_shards
+
+    def _index_shard(self, txn: Any, listing: str) -> Optional[int]:
+        """the shard of an index account, None when its the app"""
+        if listing == logic.get_application_address(txn.index):
+            return None
+        deets = self._local(listing, txn.index).get(b"deets", b"")
+        if deets[:32] != index_name:
+            raise FakeLedgerError(f"{listing} is not an index account")
+        return int.from_bytes(deets[32:], "big")
+
+    def _get_entry(
+        self, app: FakeApp, txn: Any, listing: str, fname: bytes
+    ) -> Optional[tuple[int, int, int, bytes, int]]:
+        if listing == logic.get_application_address(txn.index):
+            entry = app.global_state.get(fname)
+        else:
+            entry = self._local(listing, txn.index).get(fname)
+        return None if entry is None else FILE_ENTRY.unpack(entry)
+
+    def _put_entry(
+        self,
+        app: FakeApp,
+        txn: Any,
+        listing: str,
+        fname: bytes,
+        entry: Optional[tuple[int, int, int, bytes, int]],
+    ):
+        val = None if entry is None else FILE_ENTRY.pack(*entry)
+        if self._index_shard(txn, listing) is None:
+            self._set_global(app, fname, val)
+        else:
+            self._set_local(self._local(listing, txn.index), fname, val)
+
+    def _set_bit(self, app: FakeApp, key: bytes, bit: int):
+        bits = bytearray(app.global_state[key])
+        bits[bit // 8] |= 0x80 >> (bit % 8)
+        self._put(app.global_state, key, bytes(bits))
+
+    def _nftp_delete(self, app: FakeApp, txn: Any, deets: list, storage_account: str):
+        self._check_creator(app, txn)
+        self._check_account(txn, deets, storage_account)
+        if self.auth.get(storage_account) != logic.get_application_address(txn.index):
+            raise FakeLedgerError(f"{storage_account} is not rekeyed to the app")
+        self._rekey(storage_account, storage_account)
+
+    def _nftp_write_range(
+        self,
+        app: FakeApp,
+        txn: Any,
+        deets: list,
+        start: int,
+        data: list,
+        storage_account: str,
+        fname: list,
+        listing: str,
+    ):
+        self._check_creator(app, txn)
+        if start + len(data) > app.block_size:
+            raise FakeLedgerError("Must stay inside the block")
+        kv = self._local(storage_account, txn.index)
+        self._blob_write(app, kv, start, bytes(data))
+        self._bump_generation(app, txn, listing, fname)
+
+    def _nftp_write_pages(
+        self, app: FakeApp, txn: Any, writes: list, fname: list, listing: str
+    ):
+        self._check_creator(app, txn)
+        for acct_idx, page, data in writes:
+            if page >= len(app.blob_keys):
+                raise FakeLedgerError("Must be in the blob")
+            if acct_idx > len(txn.accounts or []):
+                raise FakeLedgerError(f"invalid Account reference {acct_idx}")
+            acct = txn.sender if acct_idx == 0 else txn.accounts[acct_idx - 1]
+            self._put(self._local(acct, txn.index), app.blob_keys[page], bytes(data))
+        self._bump_generation(app, txn, listing, fname)
+
+
+class FakeAlgodClient(AlgodClient):
+    """AlgodClient whose requests are served by a FakeAlgod instead of http"""
+
+    def __init__(self, fake: FakeAlgod):
+        super().__init__(FAKE_ALGOD_TOKEN, FAKE_ALGOD_ADDRESS)
+        self.fake = fake
+
+    def algod_request(
+        self,
+        method,
+        requrl,
+        params=None,
+        data=None,
+        headers=None,
+        response_format="json",
+    ):
+        return self.fake.request(method, requrl, params, data)
+
+    def async_client(self, pool_size: int = 16) -> "FakeAsyncAlgodClient":
+        return FakeAsyncAlgodClient(self.fake, pool_size)
+
+
+class FakeAsyncAlgodClient(AsyncAlgodClient):
+    """AsyncAlgodClient served by a FakeAlgod, its blocking requests run on the
+    loop's default executor"""
+
+    def __init__(self, fake: FakeAlgod, pool_size: int = 16):
+        super().__init__(FAKE_ALGOD_TOKEN, FAKE_ALGOD_ADDRESS, pool_size=pool_size)
+        self.fake = fake
+
+    async def request(
+        self,
+        method: str,
+        requrl: str,
+        params: Optional[dict] = None,
+        data: Optional[bytes] = None,
+        response_format: str = "json",
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.fake.request, method, requrl, params, data
+        )
+
+
+def _source_map(mappings: str) -> dict:
+    return {"version": 3, "sources": [], "names": [], "mappings": mappings}
+
+
+def _home_shard(fname: bytes) -> int:
+    return (
+        int.from_bytes(hashlib.new("sha512_256", fname).digest()[:2], "big")
+        % index_shards
+    )
+
+
+def _block_txn(txn: Any) -> dict:
+    """a txn as algod's json blocks show it, the fields a ChainWatcher reads"""
+    out: dict[str, Any] = {"type": txn.type, "snd": txn.sender}
+    if txn.note:
+        out["note"] = base64.b64encode(txn.note).decode()
+    if txn.type == "appl":
+        if txn.index:
+            out["apid"] = txn.index
+        if txn.app_args:
+            out["apaa"] = [base64.b64encode(arg).decode() for arg in txn.app_args]
+        if txn.accounts:
+            out["apat"] = list(txn.accounts)
+    return {"txn": out}
+
+
+def _encode_deets(deets: list) -> bytes:
+    return bytes(deets[0]) + deets[1].to_bytes(8, "big")
+
+
+def _encode_state(kv: dict[bytes, int | bytes]) -> list[dict]:
+    state = []
+    for key, val in kv.items():
+        if isinstance(val, int):
+            value = {"type": 2, "uint": val, "bytes": ""}
+        else:
+            value = {"type": 1, "uint": 0, "bytes": base64.b64encode(val).decode()}
+        state.append({"key": base64.b64encode(key).decode(), "value": value})
+    return state
@@ -0,0 +1,214 @@
+import asyncio
+from threading import Lock
+from typing import Iterator, Optional, cast
+import time
+
+from algosdk.atomic_transaction_composer import LogicSigTransactionSigner
+from algosdk.error import AlgodHTTPError
+import beaker as bkr
+from beaker.client.state_decode import decode_state
+from Cryptodome.Hash import SHA512
+
+from algorand.contract import app_slots, index_name, index_shards, shard_slots
+from algorand.storage_accounts import StorageAccounts
+from algorand.transport import AsyncAlgodClient, EventLoopThread
+
+# where a name is listed, a shard or the app itself
+APP = None
+
+
+def home_shard(fname: bytes) -> int:
+    """the shard a name goes in unless its full, same as contract.home_shard"""
+    digest = SHA512.new(fname, truncate="256").digest()
+    return int.from_bytes(digest[:2], "big") % index_shards
+
+
+def _bit(bits: bytes, idx: int) -> bool:
+    return bool(bits[idx // 8] & (0x80 >> (idx % 8)))
+
+
+class FileIndex:
+    """finds the FileEntry of each file of one app
+
+    the first app_slots files are listed in global state, which comes with
+    the shard bitmaps in one read of the app. The rest are in index accounts,
+    a name in its home shard or the next one along that had room, the app
+    flags every shard a name went past so a lookup reads shards until it
+    finds the name or one that was never passed. Usually thats just the one
+
+    the global state read is kept for `ttl` seconds, shards are read fresh
+    every time. We remember where names are listed and which names each
+    shard holds, so placing a new one doesnt have to read them again
+    """
+
+    def __init__(
+        self,
+        app_client: bkr.client.ApplicationClient,
+        aclient: AsyncAlgodClient,
+        io: EventLoopThread,
+        accounts: StorageAccounts,
+        ttl: float = 1.0,
+        batch: int = 16,
+    ):
+        self.app_client = app_client
+        self.aclient = aclient
+        self.io = io
+        self.accounts = accounts
+        self.ttl = ttl
+        # shards read at once while listing
+        self.batch = batch
+
+        # (files listed in global state, opted in shards, overflowed shards)
+        self.app_state: tuple[dict[bytes, bytes], bytes, bytes] = ({}, b"", b"")
+        # when the read app_state came from began and ended, and when it was
+        # last invalidated
+        self.fetched_at = 0.0
+        self.done_at = 0.0
+        self.invalidated_at = 0.0
+        # fname -> shard its listed in, or APP
+        self.where: dict[bytes, Optional[int]] = {}
+        # shard or APP -> names we know are listed there, never fewer than it has
+        self.listed: dict[Optional[int], set[bytes]] = {}
+        self.lock = Lock()
+        self.fetching = Lock()
+        # one new name placed at a time, so two cant take the last slot
+        self.placing = Lock()
+
+    def address(self, shard: int) -> str:
+        return self.accounts.address(index_name, shard)
+
+    def signer(self, shard: int) -> LogicSigTransactionSigner:
+        return self.accounts.signer(index_name, shard)
+
+    def state(self) -> tuple[dict[bytes, bytes], bytes, bytes]:
+        """what global state says, read again once its older than ttl"""
+        asked = time.monotonic()
+        if self._fresh(asked):
+            return self.app_state
+
+        with self.fetching:
+            # someone else may have read it while we waited for the lock
+            if self._fresh(asked):
+                return self.app_state
+
+            started = time.monotonic()
+            state = self.app_client.get_application_state(raw=True)
+            # everything NFTP keeps in global state is bytes
+            shards = cast(bytes, state.pop(b"shards"))
+            overflowed = cast(bytes, state.pop(b"overflowed"))
+            files = {fname: cast(bytes, entry) for fname, entry in state.items()}
+            with self.lock:
+                self._seen(APP, files)
+                self.app_state = (files, shards, overflowed)
+                self.fetched_at = started
+                self.done_at = time.monotonic()
+            return self.app_state
+
+    def _fresh(self, asked: float) -> bool:
+        """whether the last read will do for someone who asked for it at `asked`
+
+        one still under way when they asked always does, however short the
+        ttl, unless it was invalidated after the read began
+        """
+        if self.fetched_at <= self.invalidated_at:
+            return False
+        return self.done_at >= asked or time.monotonic() - self.fetched_at < self.ttl
+
+    def invalidate(self):
+        self.invalidated_at = time.monotonic()
+
+    def opened(self, shard: int) -> bool:
+        return _bit(self.state()[1], shard)
+
+    async def read_shard(self, shard: int) -> dict[bytes, bytes]:
+        """the names an index account lists and their entries"""
+        try:
+            info = await self.aclient.account_application_info(
+                self.address(shard), self.app_client.app_id
+            )
+        except AlgodHTTPError as e:
+            if e.code != 404:
+                raise e
+            # not opted in yet
+            return {}
+
+        kv = decode_state(
+            info.get("app-local-state", {}).get("key-value", []), raw=True
+        )
+        kv.pop(b"deets", None)
+        with self.lock:
+            self._seen(shard, kv)
+        return kv
+
+    def _seen(self, where: Optional[int], entries: dict[bytes, bytes]):
+        self.listed.setdefault(where, set()).update(entries)
+        for fname in entries:
+            self.where[fname] = where
+
+    def lookup(self, fname: bytes) -> Optional[bytes]:
+        """the FileEntry for fname, None if it isnt listed"""
+        files, shards, overflowed = self.state()
+        if fname in files:
+            return files[fname]
+
+        shard = home_shard(fname)
+        for _ in range(index_shards):
+            if _bit(shards, shard):
+                entries = self.io.run(self.read_shard(shard))
+                if fname in entries:
+                    return entries[fname]
+            if not _bit(overflowed, shard):
+                break
+            shard = (shard + 1) % index_shards
+
+        with self.lock:
+            self.where.pop(fname, None)
+        return None
+
+    def locate(self, fname: bytes) -> Optional[int]:
+        """where fname is listed, or where it goes if it isnt yet"""
+        with self.lock:
+            if fname in self.where:
+                return self.where[fname]
+        if self.lookup(fname) is not None:
+            return self.where[fname]
+
+        with self.placing:
+            files, shards, _ = self.state()
+            with self.lock:
+                if len(self.listed.get(APP, set()) | set(files)) < app_slots:
+                    self._seen(APP, {fname: b""})
+                    return APP
+
+            shard = home_shard(fname)
+            for _ in range(index_shards):
+                if _bit(shards, shard) and shard not in self.listed:
+                    self.io.run(self.read_shard(shard))
+                with self.lock:
+                    if len(self.listed.get(shard, set())) < shard_slots:
+                        self._seen(shard, {fname: b""})
+                        return shard
+                shard = (shard + 1) % index_shards
+        raise OSError(f"no room left in the index for {fname!r}")
+
+    def forget(self, fname: bytes):
+        """fname isnt listed anywhere anymore"""
+        with self.lock:
+            where = self.where.pop(fname, APP)
+            self.listed.get(where, set()).discard(fname)
+            self.app_state[0].pop(fname, None)
+
+    def pages(self) -> Iterator[dict[bytes, bytes]]:
+        """every listed name and its entry, global state first then a shard at a time
+
+        shards are read `batch` at a time, each is handed out as it arrives
+        """
+        files, shards, _ = self.state()
+        yield dict(files)
+
+        async def read_batch(batch: list[int]) -> list[dict[bytes, bytes]]:
+            return await asyncio.gather(*(self.read_shard(s) for s in batch))
+
+        opened = [shard for shard in range(index_shards) if _bit(shards, shard)]
+        for start in range(0, len(opened), self.batch):
+            yield from self.io.run(read_batch(opened[start : start + self.batch]))
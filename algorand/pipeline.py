@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from concurrent.futures import Future
+from threading import Lock
+from typing import Optional
+
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer
+from algosdk.error import AlgodHTTPError
+
+from algorand.transport import AsyncAlgodClient, EventLoopThread
+
+
+class GroupFailed(Exception):
+    """an atomic group that algod took but never confirmed"""
+
+    def __init__(self, txid: str, reason: str):
+        super().__init__(f"group {txid} failed: {reason}")
+        self.txid = txid
+        self.reason = reason
+
+
+class SubmitPipeline:
+    """sends atomic groups without waiting on them and confirms them in the background
+
+    `submit` returns as soon as algod accepts a group, with a Future that
+    resolves to the round it was confirmed in. A task on the io loop watches
+    every outstanding group: once per round it asks after all of them at once,
+    settles them in the order they were sent and then waits for the next
+    block, so confirmations come back in send order and cost one status call
+    per round rather than a poll per group.
+    """
+
+    def __init__(
+        self, client: AsyncAlgodClient, io: EventLoopThread, note: bytes = b""
+    ):
+        self.client = client
+        self.io = io
+        # put on every transaction sent, so a ChainWatcher can tell them apart
+        self.note = note
+        # (first txid, last valid round, future) in the order they were sent
+        self.pending: list[tuple[str, int, Future]] = []
+        self.lock = Lock()
+        self.wakeup = asyncio.Event()
+        self.last_round: Optional[int] = None
+
+        # the loop only holds tasks weakly, without this the confirming task
+        # can be collected while it waits and every group after it hangs
+        self.confirming = io.submit(self._confirm_loop())
+
+    def submit(self, atc: AtomicTransactionComposer) -> Future:
+        """send `atc`, raises if algod wont take it"""
+        if self.note:
+            for tws in atc.txn_list:
+                tws.txn.note = self.note
+        signed = atc.gather_signatures()
+        txid = self.io.run(self.client.send_transactions(signed))
+        last_valid = atc.txn_list[0].txn.last_valid_round
+
+        future: Future = Future()
+        with self.lock:
+            self.pending.append((txid, last_valid, future))
+        self.io.loop.call_soon_threadsafe(self.wakeup.set)
+        return future
+
+    def outstanding(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    async def _confirm_loop(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            while pending := self._snapshot():
+                try:
+                    await self._confirm(pending)
+                except Exception as e:
+                    logging.error(f"error confirming transactions: {e}")
+                    await asyncio.sleep(1)
+
+            # nothing to watch, the next group starts from a fresh status
+            self.last_round = None
+
+    def _snapshot(self) -> list[tuple[str, int, Future]]:
+        with self.lock:
+            return list(self.pending)
+
+    async def _confirm(self, pending: list[tuple[str, int, Future]]):
+        if self.last_round is None:
+            self.last_round = (await self.client.status())["last-round"]
+
+        infos = await asyncio.gather(
+            *(self.client.pending_transaction_info(txid) for txid, _, _ in pending),
+            return_exceptions=True,
+        )
+
+        done = set()
+        for (txid, last_valid, future), info in zip(pending, infos):
+            if isinstance(info, AlgodHTTPError):
+                # dropped from the pool, it can still show up until last valid
+                logging.debug(f"no pending info for {txid}: {info}")
+                info = {}
+            elif isinstance(info, BaseException):
+                raise info
+
+            if info.get("confirmed-round", 0) > 0:
+                future.set_result(info["confirmed-round"])
+            elif info.get("pool-error"):
+                future.set_exception(GroupFailed(txid, info["pool-error"]))
+            elif self.last_round > last_valid:
+                future.set_exception(GroupFailed(txid, "expired"))
+            else:
+                continue
+            done.add(txid)
+
+        with self.lock:
+            self.pending = [p for p in self.pending if p[0] not in done]
+            waiting = len(self.pending) > 0
+
+        if waiting:
+            status = await self.client.status_after_block(self.last_round)
+            self.last_round = status["last-round"]
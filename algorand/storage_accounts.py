@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable, Optional
+
+from algosdk import constants, encoding
+from algosdk.atomic_transaction_composer import LogicSigTransactionSigner
+from algosdk.future.transaction import LogicSigAccount
+from beaker.precompile import Precompile, py_encode_uvarint
+from Cryptodome.Hash import SHA512
+
+
+class StorageAccounts:
+    """memoized FileBlock signers and addresses for one app
+
+    populating the template and hashing it is the same work for a given
+    (file_id, idx) every time, so we do it once. `addresses` derives a whole run
+    of block addresses for a file by splicing each idx into the populated
+    program and resuming a hash of the bytes that come before it. `block_of`
+    goes the other way for any address we derived
+    """
+
+    def __init__(self, tmpl: Precompile, app_id: int, max_entries: int = 65536):
+        self.tmpl = tmpl
+        self.app_id = app_id
+        self.max_entries = max_entries
+
+        self.signers: OrderedDict[
+            tuple[bytes, int], LogicSigTransactionSigner
+        ] = OrderedDict()
+        self.addrs: OrderedDict[tuple[bytes, int], str] = OrderedDict()
+        # address -> (file_id, idx), for whatever is in addrs
+        self.blocks: dict[str, tuple[bytes, int]] = {}
+        self.lock = Lock()
+
+        names = [tv.name for tv in tmpl.template_values]
+        assert names == ["FILE_ID", "IDX", "Z_APP_ID"], f"unexpected template {names}"
+
+    def signer(self, file_id: bytes, idx: int) -> LogicSigTransactionSigner:
+        key = (file_id, idx)
+        with self.lock:
+            signer = self.signers.get(key)
+        if signer is None:
+            program = self.tmpl.populate_template(file_id, idx, self.app_id)
+            signer = LogicSigTransactionSigner(LogicSigAccount(program))
+            self._remember(self.signers, key, signer)
+        return signer
+
+    def address(self, file_id: bytes, idx: int) -> str:
+        return self.addresses(file_id, [idx])[0]
+
+    def addresses(self, file_id: bytes, idxs: Iterable[int]) -> list[str]:
+        idxs = list(idxs)
+        with self.lock:
+            found = {idx: self.addrs.get((file_id, idx)) for idx in idxs}
+
+        missing = [idx for idx, addr in found.items() if addr is None]
+        if missing:
+            # populate with idx 0 (a single byte uvarint) and cut it back out
+            program = self.tmpl.populate_template(file_id, 0, self.app_id)
+            # FILE_ID comes first and grew from a 1 byte empty value
+            pos = self.tmpl.template_values[1].pc + len(file_id)
+            head, tail = program[:pos], program[pos + 1 :]
+
+            prefix = SHA512.new(truncate="256")
+            prefix.update(constants.logic_prefix + head)
+            for idx in missing:
+                h = prefix.copy()
+                h.update(py_encode_uvarint(idx) + tail)
+                found[idx] = encoding.encode_address(h.digest())
+                self._remember(self.addrs, (file_id, idx), found[idx])
+
+        return [found[idx] for idx in idxs]
+
+    def block_of(self, addr: str) -> Optional[tuple[bytes, int]]:
+        with self.lock:
+            return self.blocks.get(addr)
+
+    def _remember(self, cache: OrderedDict, key: tuple[bytes, int], val):
+        with self.lock:
+            cache[key] = val
+            if cache is self.addrs:
+                self.blocks[val] = key
+            while len(cache) > self.max_entries:
+                _, old = cache.popitem(last=False)
+                if cache is self.addrs:
+                    self.blocks.pop(old, None)
@@ -0,0 +1,330 @@
+"""Keep-alive transports for talking to algod
+
+The SDK opens a fresh urllib connection for every request, so each call pays
+for TCP setup. PooledAlgodClient is a drop in AlgodClient that keeps a pool
+of persistent connections instead, and AsyncAlgodClient is an asyncio client
+with its own pool for the handful of endpoints on the hot paths (account and
+application state, send, pending info, status), meant to be driven from an
+EventLoopThread so the rest of the code can keep dealing in Futures.
+"""
+import asyncio
+import base64
+import http.client
+import json
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from queue import Empty, LifoQueue
+from threading import BoundedSemaphore, Thread
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional
+from urllib import parse
+
+from algosdk import constants, encoding
+from algosdk.error import AlgodHTTPError, AlgodResponseError
+from algosdk.v2client.algod import AlgodClient, api_version_path_prefix
+
+
+def request_path(requrl: str, params: Optional[dict] = None) -> str:
+    """the path + query the sdk would send for `requrl`"""
+    if requrl not in constants.unversioned_paths:
+        requrl = api_version_path_prefix + requrl
+    if params:
+        requrl = requrl + "?" + parse.urlencode(params)
+    return requrl
+
+
+def request_headers(
+    token: str, requrl: str, extra: Optional[dict] = None
+) -> dict[str, str]:
+    headers = {"User-Agent": "py-algorand-sdk"}
+    if extra:
+        headers.update(extra)
+    if requrl not in constants.no_auth:
+        headers[constants.algod_auth_header] = token
+    return headers
+
+
+def parse_response(status: int, body: bytes, response_format: str = "json") -> Any:
+    """turn an algod response into what AlgodClient.algod_request returns"""
+    if status >= 400:
+        msg = body.decode("utf-8")
+        try:
+            msg = json.loads(msg)["message"]
+        except Exception:
+            pass
+        raise AlgodHTTPError(msg, status)
+
+    if response_format != "json":
+        return body
+    try:
+        return json.loads(body)
+    except Exception as e:
+        raise AlgodResponseError("Failed to parse JSON response from algod") from e
+
+
+class PooledAlgodClient(AlgodClient):
+    """AlgodClient that reuses up to `pool_size` keep-alive connections"""
+
+    def __init__(
+        self,
+        algod_token: str,
+        algod_address: str,
+        headers: Optional[dict] = None,
+        pool_size: int = 8,
+        timeout: float = 30.0,
+    ):
+        super().__init__(algod_token, algod_address, headers)
+        url = parse.urlsplit(algod_address)
+        self.scheme = url.scheme
+        self.host = url.hostname or "localhost"
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.base_path = url.path.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self.idle: LifoQueue[http.client.HTTPConnection] = LifoQueue()
+        self.slots = BoundedSemaphore(pool_size)
+
+    def algod_request(
+        self,
+        method,
+        requrl,
+        params=None,
+        data=None,
+        headers=None,
+        response_format="json",
+    ):
+        path = self.base_path + request_path(requrl, params)
+        header = request_headers(self.algod_token, requrl, self.headers)
+        if headers:
+            header.update(headers)
+
+        with self._connection() as conn:
+            status, body = self._roundtrip(conn, method, path, data, header)
+        return parse_response(status, body, response_format)
+
+    def async_client(self, pool_size: Optional[int] = None) -> "AsyncAlgodClient":
+        """an AsyncAlgodClient for the same algod, with a pool of its own"""
+        return AsyncAlgodClient(
+            self.algod_token,
+            self.algod_address,
+            self.headers,
+            self.pool_size if pool_size is None else pool_size,
+        )
+
+    @contextmanager
+    def _connection(self) -> Iterator[http.client.HTTPConnection]:
+        with self.slots:
+            try:
+                conn = self.idle.get_nowait()
+            except Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except Exception:
+                conn.close()
+                raise
+            self.idle.put(conn)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _roundtrip(
+        self,
+        conn: http.client.HTTPConnection,
+        method: str,
+        path: str,
+        data: Optional[bytes],
+        headers: dict[str, str],
+    ) -> tuple[int, bytes]:
+        # an idle connection the server has since closed fails straight away,
+        # try once more on a fresh one
+        for attempt in range(2):
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+                if resp.will_close:
+                    conn.close()
+                return resp.status, body
+            except (http.client.RemoteDisconnected, ConnectionResetError) as e:
+                conn.close()
+                if attempt == 1:
+                    raise e
+        raise AssertionError("unreachable")
+
+
+class AsyncAlgodClient:
+    """asyncio algod client for the endpoints nftp reads, writes and confirms with
+
+    requests share up to `pool_size` keep-alive HTTP/1.1 connections, which
+    also caps how many are in flight at once
+    """
+
+    def __init__(
+        self,
+        algod_token: str,
+        algod_address: str,
+        headers: Optional[dict] = None,
+        pool_size: int = 16,
+    ):
+        self.algod_token = algod_token
+        self.algod_address = algod_address
+        self.headers = headers
+        url = parse.urlsplit(algod_address)
+        self.ssl = url.scheme == "https"
+        self.host = url.hostname or "localhost"
+        self.port = url.port or (443 if self.ssl else 80)
+        self.base_path = url.path.rstrip("/")
+        self.pool_size = pool_size
+
+        self.idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        # made on first use so it belongs to the loop we run on
+        self.slots: Optional[asyncio.Semaphore] = None
+
+    async def request(
+        self,
+        method: str,
+        requrl: str,
+        params: Optional[dict] = None,
+        data: Optional[bytes] = None,
+        response_format: str = "json",
+    ) -> Any:
+        path = self.base_path + request_path(requrl, params)
+        headers = request_headers(self.algod_token, requrl, self.headers)
+        headers["Host"] = f"{self.host}:{self.port}"
+        headers["Content-Length"] = str(len(data or b""))
+
+        head = f"{method} {path} HTTP/1.1\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+        raw = head.encode() + (data or b"")
+
+        async with self._connection() as conn:
+            status, body = await self._roundtrip(conn, raw)
+        return parse_response(status, body, response_format)
+
+    #
+    # endpoints
+    #
+
+    async def status(self) -> dict:
+        return await self.request("GET", "/status")
+
+    async def status_after_block(self, block_num: int) -> dict:
+        return await self.request("GET", f"/status/wait-for-block-after/{block_num}")
+
+    async def account_info(self, address: str) -> dict:
+        return await self.request("GET", f"/accounts/{address}")
+
+    async def account_application_info(self, address: str, app_id: int) -> dict:
+        return await self.request("GET", f"/accounts/{address}/applications/{app_id}")
+
+    async def application_info(self, app_id: int) -> dict:
+        return await self.request("GET", f"/applications/{app_id}")
+
+    async def block_info(self, round_num: int) -> dict:
+        return await self.request("GET", f"/blocks/{round_num}", {"format": "json"})
+
+    async def pending_transaction_info(self, txid: str) -> dict:
+        return await self.request("GET", f"/transactions/pending/{txid}")
+
+    async def send_transactions(self, txns: list) -> str:
+        """send a signed group, returns the first txid like the sdk does"""
+        data = b"".join(base64.b64decode(encoding.msgpack_encode(txn)) for txn in txns)
+        resp = await self.request("POST", "/transactions", data=data)
+        return resp["txId"]
+
+    #
+    # connections
+    #
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[list]:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.pool_size)
+
+        async with self.slots:
+            # a mutable pair so _roundtrip can swap in a fresh connection
+            conn: list = list(self.idle.pop()) if self.idle else [None, None]
+            try:
+                yield conn
+            except BaseException:
+                if conn[1] is not None:
+                    conn[1].close()
+                raise
+            if conn[1] is not None and not conn[1].is_closing():
+                self.idle.append((conn[0], conn[1]))
+
+    async def _roundtrip(self, conn: list, raw: bytes) -> tuple[int, bytes]:
+        for attempt in range(2):
+            fresh = conn[1] is None
+            if fresh:
+                conn[0], conn[1] = await asyncio.open_connection(
+                    self.host, self.port, ssl=self.ssl or None
+                )
+            try:
+                conn[1].write(raw)
+                await conn[1].drain()
+                return await self._read_response(conn)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                conn[1].close()
+                conn[0] = conn[1] = None
+                # only a reused connection gets a second go, the server may
+                # have closed it while it sat idle
+                if fresh or attempt == 1:
+                    raise e
+        raise AssertionError("unreachable")
+
+    async def _read_response(self, conn: list) -> tuple[int, bytes]:
+        reader: asyncio.StreamReader = conn[0]
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+
+        headers: dict[str, str] = {}
+        while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+            key, _, val = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = val.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while size := int((await reader.readuntil(b"\r\n")).split(b";")[0], 16):
+                body += (await reader.readexactly(size + 2))[:-2]
+            await reader.readuntil(b"\r\n")
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close":
+            conn[1].close()
+            conn[0] = conn[1] = None
+        return status, body
+
+
+def async_client_for(client: AlgodClient, pool_size: int = 16) -> AsyncAlgodClient:
+    """an AsyncAlgodClient talking to the same algod as `client`"""
+    make = getattr(client, "async_client", None)
+    if make is not None:
+        return make(pool_size)
+    return AsyncAlgodClient(
+        client.algod_token, client.algod_address, client.headers, pool_size
+    )
+
+
+class EventLoopThread:
+    """an asyncio loop running on its own thread, coroutines go in and Futures come out"""
+
+    def __init__(self, name: str = "nftp-io"):
+        self.loop = asyncio.new_event_loop()
+        Thread(target=self.loop.run_forever, name=name, daemon=True).start()
+
+    def submit(self, coro: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine) -> Any:
+        """run `coro` on the loop and wait for it, never call this from the loop"""
+        return self.submit(coro).result()
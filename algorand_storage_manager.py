@@ -1,182 +1,1029 @@
+import asyncio
 import base64
-from typing import cast
+from concurrent.futures import Future, wait
+from copy import copy
+from dataclasses import dataclass
+from threading import Lock, RLock, Thread
+from typing import Coroutine, Iterator, Optional, cast
+import errno
 import logging
+import os
 import stat
+import time
 from algosdk.abi import ABIType
-from algosdk.atomic_transaction_composer import LogicSigTransactionSigner
+from algosdk.error import AlgodHTTPError
+from algosdk.atomic_transaction_composer import (
+    AtomicTransactionComposer,
+    LogicSigTransactionSigner,
+    TransactionWithSigner,
+)
+from algosdk.future.transaction import OnComplete, PaymentTxn, SuggestedParams
 import beaker as bkr
+from beaker.client.state_decode import decode_state
+from beaker.lib.storage.blob import blob_page_size
 
-from algorand.contract import NFTP, FileBlockDetails
-from nftp import StorageManager, FileStat
+from algorand.contract import (
+    NFTP,
+    FileBlockDetails,
+    FileEntry,
+    PageWrite,
+    index_name,
+    max_name_size,
+)
+from algorand.chain_watcher import ChainWatcher, RoundChanges
+from algorand.fake_algod import FakeAlgod
+from algorand.file_index import APP, FileIndex
+from algorand.pipeline import SubmitPipeline
+from algorand.storage_accounts import StorageAccounts
+from algorand.transport import EventLoopThread, PooledAlgodClient, async_client_for
+from block_cache import BlockCache
+from nftp import FileHandle, StorageManager, FileStat
+from readahead import ReadAhead
 
 
 ALGOD_HOST = "http://localhost:4001"
 ALGOD_TOKEN = "a" * 64
 
 storage_deets_codec = ABIType.from_string(str(FileBlockDetails().type_spec()))
+file_entry_codec = ABIType.from_string(str(FileEntry().type_spec()))
+
+# most transactions the network accepts in one atomic group
+MAX_GROUP_SIZE = 16
+# an app call carries at most 2048 bytes of args and 4 foreign accounts, so a
+# write_pages call fits this many PageWrites after its selector, their length
+# and the file it bumps the generation of, whose listing takes an account
+PAGES_PER_CALL = (
+    2048 - 4 - 2 - (2 + 1 + max_name_size) - 1
+) // PageWrite().type_spec().byte_length_static()
+ACCOUNTS_PER_CALL = 3
+
+# an unread dirty block written in more pieces than this is read in and sent
+# whole, rather than as one write_range per piece
+MAX_WRITE_RANGES = 4
+
+# while a ChainWatcher drops whatever a round changes, cached stats only
+# expire after this in case it missed something
+WATCHED_TTL = 60.0
+
+
+def check_app(app_client: bkr.client.ApplicationClient):
+    """make sure the app runs the NFTP the client was built for, block size and all
+
+    reads of an app with other sized blocks come back misaligned or not at
+    all. The local schema is the same whatever the block size, so its the
+    approval program thats compared
+    """
+    app_client.build()
+    info = app_client.client.application_info(app_client.app_id)
+    deployed = base64.b64decode(info["params"]["approval-program"])
+    if deployed != app_client.approval_binary:
+        block_size = cast(NFTP, app_client.app).block_size
+        raise ValueError(
+            f"app {app_client.app_id} isnt an NFTP with {block_size} byte blocks,"
+            " it takes the block size it was created with"
+        )
+
+
+def _zero(block: bytes | bytearray) -> bool:
+    return block.count(0) == len(block)
+
+
+def _merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _page_calls(blocks: dict[int, "DirtyBlock"]) -> list[list[tuple[int, int]]]:
+    """pack the pages of the known `blocks` into write_pages calls of (idx, page)
+
+    blocks we havent read cant be sent a page at a time, they go out as a
+    write_range per range instead
+    """
+    calls: list[list[tuple[int, int]]] = []
+    for idx, block in sorted(blocks.items()):
+        if not block.known:
+            continue
+        for page in block.pages():
+            accts = {i for i, _ in calls[-1]} | {idx} if calls else set()
+            if (
+                not calls
+                or len(calls[-1]) == PAGES_PER_CALL
+                or len(accts) > ACCOUNTS_PER_CALL
+            ):
+                calls.append([])
+            calls[-1].append((idx, page))
+    return calls
+
+
+def _num_txns(blocks: dict[int, "DirtyBlock"]) -> int:
+    ranges = sum(len(block.ranges) for block in blocks.values() if not block.known)
+    return len(_page_calls(blocks)) + ranges
+
+
+@dataclass
+class DirtyBlock:
+    """a block written since it was last sent to chain
+
+    `ranges` are the (start, end) spans of `data` written since. When `known`
+    is False we never read the block, so only those spans of `data` are real
+    and the rest has to come from chain
+    """
+
+    data: bytearray
+    ranges: list[tuple[int, int]]
+    known: bool = True
+
+    def write(self, start: int, chunk: bytes):
+        self.data[start : start + len(chunk)] = chunk
+        self.ranges = _merge_ranges(self.ranges + [(start, start + len(chunk))])
+
+    def apply(self, base: bytes) -> bytes:
+        """`base` with this block written over it"""
+        if self.known:
+            return bytes(self.data)
+        block = bytearray(base)
+        for lo, hi in self.ranges:
+            block[lo:hi] = self.data[lo:hi]
+        return bytes(block)
+
+    def under(self, older: "DirtyBlock"):
+        """put `older` beneath what this block holds, as if written first"""
+        if not self.known:
+            self.data = bytearray(self.apply(older.data))
+            self.known = older.known
+        self.ranges = _merge_ranges(older.ranges + self.ranges)
+
+    def pages(self) -> list[int]:
+        """the blob pages the ranges touch"""
+        return sorted(
+            {
+                page
+                for lo, hi in self.ranges
+                for page in range(lo // blob_page_size, (hi - 1) // blob_page_size + 1)
+            }
+        )
+
+    def snapshot(self) -> "DirtyBlock":
+        return DirtyBlock(bytearray(self.data), list(self.ranges), self.known)
+
+
+class AlgorandFileHandle(FileHandle):
+    """an open file with its own read ahead stream"""
+
+    def __init__(self, name: str, fst: FileStat, flags: int, readahead: ReadAhead):
+        super().__init__(name, fst, flags)
+        self.readahead = readahead
 
 
 class AlgorandStorageManager(StorageManager):
     def __init__(
-        self, app_client: bkr.client.ApplicationClient, storage_size: int = 1024
+        self,
+        app_client: bkr.client.ApplicationClient,
+        block_cache_bytes: int = 8 * 1024 * 1024,
+        readahead_blocks: int = 64,
+        prefetch_workers: int = 8,
+        fetch_concurrency: int = 16,
+        writeback_bytes: int = 4 * 1024 * 1024,
+        writeback_age: float = 5.0,
+        watch_chain: bool = False,
+        **kwargs,
     ):
         self.app_client = app_client
         self.app_client.build()
-        self.storage_size = storage_size
-        super().__init__()
+        # bytes of a file each storage account holds, set when the app is built
+        self.storage_size = cast(NFTP, self.app_client.app).block_size
+        self.blob_pages = -(-self.storage_size // blob_page_size)
+        self.block_cache = BlockCache(block_cache_bytes)
+        self.storage_accounts = StorageAccounts(
+            cast(NFTP, self.app_client.app).tmpl_account, self.app_client.app_id
+        )
+
+        self.readahead_blocks = readahead_blocks
+        self.readahead: dict[str, ReadAhead] = {}
+        # smoothed seconds a single block fetch takes, used to size read ahead
+        self.fetch_latency = 0.0
+
+        # reads, provisioning lookups and confirmations all run as coroutines
+        # on one io thread, sharing `fetch_concurrency` keep-alive connections
+        self.io = EventLoopThread()
+        self.aclient = async_client_for(self.app_client.client, fetch_concurrency)
+        # so read ahead cant take every connection from demand reads
+        self.prefetch_slots = asyncio.Semaphore(prefetch_workers)
+        # block key -> in flight fetch
+        self.inflight: dict[tuple[int, bytes, int], Future] = {}
+        self.inflight_lock = Lock()
+
+        # name -> id of the file, its storage accounts are derived from this
+        # rather than the name so a rename leaves them where they are
+        self.ids: dict[str, bytes] = {}
+        # name -> idx -> block contents not yet written to chain
+        self.dirty: dict[str, dict[int, DirtyBlock]] = {}
+        # name -> when its oldest dirty block was buffered
+        self.dirty_since: dict[str, float] = {}
+        # name -> block idxs inside the file without storage accounts, holes
+        # that read as zeros until something other than zeros is flushed there
+        self.unprovisioned: dict[str, set[int]] = {}
+        # name -> length in bytes to put on chain with the next flush
+        self.resize_to: dict[str, int] = {}
+        # file id -> generation our cached blocks of it are from, a stat that
+        # says otherwise means someone else changed them
+        self.generations: dict[bytes, int] = {}
+        # file id -> calls of ours bumping its generation sent but not settled,
+        # a stat may or may not have them yet
+        self.bumping: dict[bytes, int] = {}
+        # guards the maps above, never held across a call to the chain
+        self.dirty_lock = Lock()
+        # name -> lock serializing writes, flushes and deletes of that file
+        self.file_locks: dict[str, RLock] = {}
+
+        # writes go out without waiting on the chain, until their group is
+        # confirmed reads of those blocks are answered from here
+        # a watcher skips what we sent by this note
+        self.note = os.urandom(8) if watch_chain else b""
+        self.pipeline = SubmitPipeline(self.aclient, self.io, self.note)
+        # block key -> (contents sent, group confirming them)
+        self.pending: dict[tuple[int, bytes, int], tuple[DirtyBlock, Future]] = {}
+        # name -> (length sent, group confirming it)
+        self.resizing: dict[str, tuple[int, Future]] = {}
+        # name -> groups sent since the file was last synced
+        self.submitted: dict[str, list[Future]] = {}
+        # name -> why a write in the background didnt make it to chain
+        self.write_errors: dict[str, Exception] = {}
+        self.writeback_bytes = writeback_bytes
+        self.writeback_age = writeback_age
+
+        super().__init__(**kwargs)
+        # the ttls whenever a watcher isnt following rounds for us
+        self.unwatched_ttls = (self.attr_ttl, self.negative_ttl)
+
+        # where each file is listed, read no more often than the stats it feeds
+        self.index = FileIndex(
+            self.app_client,
+            self.aclient,
+            self.io,
+            self.storage_accounts,
+            ttl=self.attr_ttl,
+            batch=fetch_concurrency,
+        )
+
+        # other mounts writing to the app, followed round by round
+        self.watcher: Optional[ChainWatcher] = None
+        if watch_chain:
+            self.watcher = ChainWatcher(
+                self.aclient,
+                self.io,
+                self.app_client.app_id,
+                self.storage_accounts,
+                self._chain_changed,
+                self._following,
+                self.note,
+            )
+
+        if self.writeback_age > 0:
+            Thread(
+                target=self._writeback_loop, name="nftp-writeback", daemon=True
+            ).start()
 
     @staticmethod
     def factory(args) -> "AlgorandStorageManager":
-        # TODO: Cheating
-        acct = bkr.sandbox.get_accounts().pop()
-        algod_client = bkr.sandbox.clients.get_algod_client()
+        if args.algorand_fake:
+            app_client = FakeAlgod(rtt=args.algorand_fake_rtt).create_app_client(
+                args.algorand_block_size
+            )
+        else:
+            # TODO: Cheating
+            acct = bkr.sandbox.get_accounts().pop()
+            algod_client = PooledAlgodClient(
+                ALGOD_TOKEN, ALGOD_HOST, pool_size=args.algod_connections
+            )
+            app_client = bkr.client.application_client.ApplicationClient(
+                algod_client,
+                NFTP(block_size=args.algorand_block_size),
+                signer=acct.signer,
+                app_id=args.algorand_appid,
+            )
+            check_app(app_client)
 
         return AlgorandStorageManager(
-            app_client=bkr.client.application_client.ApplicationClient(
-                algod_client, NFTP(), signer=acct.signer, app_id=args.algorand_appid
-            )
+            app_client=app_client,
+            block_cache_bytes=args.block_cache_bytes,
+            readahead_blocks=args.readahead_blocks,
+            fetch_concurrency=args.fetch_concurrency,
+            writeback_bytes=args.writeback_bytes,
+            writeback_age=args.writeback_age,
+            watch_chain=args.watch_chain,
+            attr_ttl=args.attr_ttl,
+            negative_ttl=args.negative_ttl,
         )
 
     def list_files(self) -> dict[str, FileStat]:
+        files: dict[str, FileStat] = {}
+        for page in self.list_pages():
+            files.update(page)
+        return files
 
-        app_state = self.app_client.get_application_state(raw=True)
-        logging.info(f"{app_state}")
+    def list_pages(self) -> Iterator[dict[str, FileStat]]:
+        for entries in self.index.pages():
+            page: dict[str, FileStat] = {}
+            for key, entry in entries.items():
+                name = key[1:].decode("utf-8")
+                page[name] = self._file_stat(name, entry)
+            yield page
 
-        files: dict[str, FileStat] = {}
-        for fname, num_boxes in app_state.items():
-            fname = self.strip_leading_zeros(fname).decode("utf-8")
-            if fname not in files or num_boxes > files[fname].num_boxes:
-                # Idk about the order of these being guaranteed
-                fst = FileStat(num_boxes)
-                fst.st_mode = stat.S_IFREG | 0o666
-                fst.st_nlink = 1
-                fst.st_size = self.storage_size * num_boxes
-                files[fname] = fst
+    def find_file(self, name: str) -> Optional[FileStat]:
+        entry = self.index.lookup(self._index_key(name))
+        return None if entry is None else self._file_stat(name, entry)
 
-        return files
+    def invalidate(self, name: Optional[str] = None):
+        super().invalidate(name)
+        # and the global state read the stats came from
+        self.index.invalidate()
+
+    def _following(self, following: bool):
+        """the watcher started or stopped following rounds, stats last longer while it does"""
+        attr_ttl, negative_ttl = self.unwatched_ttls
+        if following:
+            attr_ttl = max(attr_ttl, WATCHED_TTL)
+            negative_ttl = max(negative_ttl, WATCHED_TTL)
+        self.attr_ttl = attr_ttl
+        self.negative_ttl = negative_ttl
+        self.index.ttl = attr_ttl
+
+    def _chain_changed(self, changes: RoundChanges):
+        """drop what someone else changed in a round from our caches"""
+        if changes.everything:
+            self.block_cache.clear()
+            self.index.invalidate()
+            with self.files_lock:
+                names = list(self.files)
+            for name in names:
+                self.changed(name)
+            self.invalidate()
+            return
+
+        if changes.listing:
+            self.index.invalidate()
+
+        names = {key[1:].decode("utf-8", "replace") for key in changes.names}
+        with self.dirty_lock:
+            by_id = {file_id: name for name, file_id in self.ids.items()}
+        for file_id, idx in changes.blocks:
+            self.block_cache.invalidate((self.app_client.app_id, file_id, idx))
+            name = by_id.get(file_id)
+            if name is None:
+                continue
+            names.add(name)
+            with self.dirty_lock:
+                # it may have been opted in since we found it was a hole
+                if idx not in self.dirty.get(name, {}):
+                    self.unprovisioned.get(name, set()).discard(idx)
+
+        for name in names:
+            self.changed(name)
+
+    def _file_stat(self, name: str, entry: bytes) -> FileStat:
+        """the stat of a file from its FileEntry"""
+        length, extent, num_stored, file_id, generation = file_entry_codec.decode(entry)
+        file_id = bytes(file_id)
+        # blocks past the end keep their accounts for when it grows again
+        num_boxes = max(extent, self._blocks(length))
+        fst = FileStat(num_boxes, num_stored)
+        fst.st_mode = stat.S_IFREG | 0o666
+        fst.st_nlink = 1
+        # from the id, so a file keeps its inode when its renamed
+        fst.st_ino = int.from_bytes(file_id[:7], "big")
+        fst.st_size = length
+        fst.generation = generation
+        # holes take no space, so du shows what the file really costs
+        fst.st_blocks = self.storage_size * num_stored // 512
+
+        # lengths we havent got on chain yet win over what it says, as do
+        # blocks written but not provisioned yet
+        with self.dirty_lock:
+            if self.ids.setdefault(name, file_id) != file_id:
+                # a different file has the name now, the holes we found were
+                # the old one's
+                self.ids[name] = file_id
+                self.unprovisioned.pop(name, None)
+            seen = self.generations.get(file_id)
+            sent = self.bumping.get(file_id, 0)
+            foreign = seen is not None and not seen <= generation <= seen + sent
+            if sent == 0:
+                self.generations[file_id] = generation
+            elif foreign:
+                # cant tell which of ours it has, count again once they settle
+                del self.generations[file_id]
+            length = self.resize_to.get(name)
+            if length is None and name in self.resizing:
+                length = self.resizing[name][0]
+            if length is not None:
+                fst.st_size = length
+                fst.num_boxes = max(fst.num_boxes, self._blocks(length))
+            idxs = self.unprovisioned.get(name)
+            if idxs:
+                fst.num_boxes = max(fst.num_boxes, max(idxs) + 1)
+
+        if foreign:
+            # written, opted in or closed out by someone else since
+            for idx in range(num_boxes):
+                self.block_cache.invalidate((self.app_client.app_id, file_id, idx))
+            self.changed(name)
+
+        return fst
 
-    def strip_leading_zeros(self, name: bytes) -> bytes:
-        for idx, b in enumerate(name):
-            if b != 0:
-                return name[idx:]
-        return b""
+    def _blocks(self, length: int) -> int:
+        """how many blocks it takes to hold `length` bytes"""
+        return -(-length // self.storage_size)
+
+    def _index_key(self, name: str) -> bytes:
+        """what `name` is listed under in the index"""
+        if len(name.encode("utf-8")) > max_name_size:
+            raise OSError(errno.ENAMETOOLONG, "file name too long", name)
+        return ("/" + name).encode("utf-8")
 
     def create_file(self, name: str, mode: int, dev: int):
-        self._create_acct(name, 0)
-        self.files = self.list_files()
+        key = self._index_key(name)
+        with self._file_lock(name):
+            with self.dirty_lock:
+                self.ids[name] = os.urandom(32)
+            try:
+                self._create_acct(name, 0)
+            except Exception as e:
+                # give back the slot it was placed in
+                self.index.forget(key)
+                with self.dirty_lock:
+                    self.ids.pop(name, None)
+                raise e
+            self.refresh_file(name)
         logging.debug(f"{self.files}")
 
     def read_file(self, name: str, offset: int, size: int) -> bytes:
-        # refreshes our list
+        # refreshes our list if its gone stale
         self.file_exists(name)
+        fst = self._stat_of(name)
+
+        ra = self.readahead.setdefault(name, self._new_readahead())
+        return self._read(name, fst, offset, size, ra)
+
+    def _stat_of(self, name: str) -> FileStat:
+        """the cached stat of `name`, it may have been unlinked since we looked"""
+        fst = self.files.get(name)
+        if fst is None:
+            raise FileNotFoundError(errno.ENOENT, "no such file", name)
+        return fst
 
-        slen = self.files[name].num_boxes * self.storage_size
+    def read_handle(self, fh: FileHandle, offset: int, size: int) -> bytes:
+        fh = cast(AlgorandFileHandle, fh)
+        return self._read(fh.name, self.handle_stat(fh), offset, size, fh.readahead)
+
+    def open_file(self, name: str, flags: int) -> FileHandle:
+        fh = super().open_file(name, flags)
+        # derive the addresses of every block up front in one go
+        self._storage_addresses(name, list(range(fh.fst.num_boxes)))
+        return AlgorandFileHandle(name, fh.fst, flags, self._new_readahead())
+
+    def _new_readahead(self) -> ReadAhead:
+        return ReadAhead(self.storage_size, max_blocks=self.readahead_blocks)
+
+    def _read(
+        self, name: str, fst: FileStat, offset: int, size: int, ra: ReadAhead
+    ) -> bytes:
+        slen = fst.st_size
 
         logging.debug(f"read file: {slen}")
 
         buf = b""
-        if offset < slen:
+        if offset < slen and size > 0:
             if offset + size > slen:
                 size = slen - offset
 
             start_box = offset // self.storage_size
             start_offset = offset % self.storage_size
 
-            stop_box = (size + offset) // self.storage_size
-            stop_offset = (size + offset) % self.storage_size
+            # exclusive, include the box holding the last partial chunk
+            stop_box = -(-(offset + size) // self.storage_size)
 
-            logging.debug(
-                "{} {} {} {}".format(start_box, start_offset, stop_box, stop_offset)
-            )
-            for box_idx in range(start_box, stop_box):
+            logging.debug(f"{start_box} {start_offset} {stop_box}")
 
-                working_buf = self._read_acct(name, box_idx)
-                start, stop = 0, self.storage_size
+            blocks = self._read_accts(name, range(start_box, stop_box))
+            # trim the ends before joining so the data is only copied once
+            end_offset = offset + size - (stop_box - 1) * self.storage_size
+            blocks[-1] = blocks[-1][:end_offset]
+            blocks[0] = blocks[0][start_offset:]
+            buf = b"".join(blocks)
 
-                if box_idx == start_box and start_offset > 0:
-                    start = start_offset
+            self._readahead(name, offset, size, slen, ra)
 
-                if box_idx == stop_box and stop_offset > 0:
-                    stop = self.storage_size - stop_offset
+        # nothing at or past the end, same as any other file, or when asked for none
+        return buf
 
-                buf += working_buf[start:stop]
+    def _readahead(self, name: str, offset: int, size: int, slen: int, ra: ReadAhead):
+        """kick off background fetches for the blocks a sequential reader wants next"""
+        window = ra.observe(offset, size, self.fetch_latency)
+        next_box = -(-(offset + size) // self.storage_size)
+        last_box = -(-slen // self.storage_size)
+        for box_idx in range(next_box, min(next_box + window, last_box)):
+            self._prefetch(name, box_idx)
 
-            buf = buf.strip(bytes(1))
-        else:
-            buf = bytes(size)
+    def _prefetch(self, name: str, idx: int):
+        self._fetch_async(name, idx, prefetch=True)
 
-        return buf
+    def _read_accts(self, name: str, idxs: range) -> list[bytes]:
+        """read a run of blocks, fetching whatever isnt cached concurrently"""
+        blocks: dict[int, bytes] = {}
+        futures: dict[int, Future] = {}
+        for idx in idxs:
+            cached = self._buffered_block(name, idx)
+            if cached is None and self._is_hole(name, idx):
+                cached = bytes(self.storage_size)
+            if cached is None:
+                cached = self.block_cache.get(self._block_key(name, idx))
+            if cached is not None:
+                blocks[idx] = cached
+                continue
+
+            future = self._fetch_async(name, idx)
+            if future is None:
+                blocks[idx] = self._read_acct(name, idx)
+            else:
+                futures[idx] = future
+
+        for idx, future in futures.items():
+            try:
+                blocks[idx] = future.result()
+            except Exception as e:
+                # probably a failed prefetch, try once more ourselves
+                logging.debug(f"fetch of {name}:{idx} failed, retrying: {e}")
+                blocks[idx] = self._fetch_acct(name, idx)
+
+        with self.dirty_lock:
+            # blocks written without being read only hold the parts written
+            dirty = self.dirty.get(name, {})
+            return [
+                dirty[idx].apply(blocks[idx]) if idx in dirty else blocks[idx]
+                for idx in idxs
+            ]
+
+    def _fetch_async(
+        self, name: str, idx: int, prefetch: bool = False
+    ) -> Optional[Future]:
+        """fetch a block on the io loop unless its cached, reusing any fetch in flight"""
+        if self._is_hole(name, idx):
+            return None
+
+        key = self._block_key(name, idx)
+        with self.inflight_lock:
+            if key in self.inflight:
+                return self.inflight[key]
+            if key in self.block_cache:
+                return None
+            coro = self._fetch_acct_async(name, idx)
+            if prefetch:
+                coro = self._prefetch_acct(coro)
+            future = self.io.submit(coro)
+            self.inflight[key] = future
+
+        def done(_):
+            with self.inflight_lock:
+                if self.inflight.get(key) is future:
+                    del self.inflight[key]
+
+        future.add_done_callback(done)
+        return future
+
+    def _wait_inflight(self, key: tuple[int, bytes, int]) -> Optional[bytes]:
+        """wait out a background fetch of `key`, None if there wasnt one or it failed"""
+        with self.inflight_lock:
+            future = self.inflight.get(key)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logging.debug(f"prefetch of {key} failed: {e}")
+            return None
 
     def write_file(self, name: str, offset: int, buf: bytes):
+        """buffer `buf` into dirty blocks, they hit the chain on flush_file"""
+        end = offset + len(buf)
         start_box = offset // self.storage_size
-        start_offset = offset % self.storage_size
+        stop_box = -(-end // self.storage_size)
 
-        stop_box = (offset + len(buf)) // self.storage_size
-        stop_offset = (offset + len(buf)) % self.storage_size
+        logging.debug(f"buffering {len(buf)} bytes into boxes {start_box}:{stop_box}")
 
-        num_boxes_to_write = (stop_box - start_box) + 1
+        with self._file_lock(name):
+            unprovisioned = self._set_length(name, end, grow_only=True)
 
-        logging.debug(
-            f"writing {len(buf)} bytes from {start_box} : {start_offset} to {stop_box} : {stop_offset}"
-        )
+            for box_idx in range(start_box, stop_box):
+                box_start = box_idx * self.storage_size
+                lo = max(offset, box_start)
+                hi = min(end, box_start + self.storage_size)
+                self._buffer_write(
+                    name,
+                    box_idx,
+                    lo - box_start,
+                    buf[lo - offset : hi - offset],
+                    box_idx in unprovisioned,
+                )
+
+        if self._dirty_bytes() > self.writeback_bytes:
+            self.flush_file(name)
+
+        return len(buf)
+
+    def _set_length(self, name: str, length: int, grow_only: bool = False) -> set[int]:
+        """make `name` `length` bytes long, returns the file's holes
+
+        blocks it grows into (and any gap before them) are holes. They get
+        storage accounts when the file is flushed, but only those that end up
+        holding something other than zeros. The length itself goes to chain
+        with the next flush
+        """
+        with self.dirty_lock:
+            fst = self.files[name]
+            unprovisioned = self.unprovisioned.setdefault(name, set())
+            num_boxes = self._blocks(length)
+            if num_boxes > fst.num_boxes:
+                unprovisioned.update(range(fst.num_boxes, num_boxes))
+                fst.num_boxes = num_boxes
+            if length > fst.st_size or (length < fst.st_size and not grow_only):
+                fst.st_size = length
+                self.resize_to[name] = length
+                self.dirty_since.setdefault(name, time.monotonic())
+            return unprovisioned
+
+    def _is_hole(self, name: str, idx: int) -> bool:
+        with self.dirty_lock:
+            return idx in self.unprovisioned.get(name, ())
 
-        cursor = 0
-        for idx in range(num_boxes_to_write):
-            box_idx = start_box + idx
+    def _unknown_holes(self, name: str) -> bool:
+        """whether `name` has holes we havent come across yet
 
-            if box_idx >= self.files[name].num_boxes:
-                self._create_acct(name, box_idx)
-                self.files = self.list_files()
+        only files written by someone else can, we learn where their holes are
+        as reads turn up blocks without storage accounts
+        """
+        fst = self.files.get(name)
+        with self.dirty_lock:
+            known = len(self.unprovisioned.get(name, ()))
+        return fst is not None and fst.num_stored + known < fst.num_boxes
 
+    def _file_lock(self, name: str) -> RLock:
+        with self.dirty_lock:
+            return self.file_locks.setdefault(name, RLock())
+
+    def _buffer_write(
+        self, name: str, idx: int, start: int, chunk: bytes, new: bool = False
+    ):
+        """copy `chunk` into the dirty block `idx`, callers hold the file lock
+
+        a partial write to a block we dont have doesnt read it first, only the
+        range written goes to chain, see DirtyBlock
+        """
+        with self.dirty_lock:
+            block = self.dirty.get(name, {}).get(idx)
+
+        if block is None:
+            if len(chunk) == self.storage_size or new:
+                block = DirtyBlock(bytearray(self.storage_size), [])
+            else:
+                base = self._buffered_block(name, idx)
+                if base is None:
+                    base = self.block_cache.get(self._block_key(name, idx))
+                if base is None:
+                    block = DirtyBlock(bytearray(self.storage_size), [], known=False)
+                else:
+                    block = DirtyBlock(bytearray(base), [])
+
+            with self.dirty_lock:
+                self.dirty.setdefault(name, {})[idx] = block
+                self.dirty_since.setdefault(name, time.monotonic())
+        elif not block.known and len(block.ranges) >= MAX_WRITE_RANGES:
+            # cheaper to read it in than to send every piece on its own
+            base = DirtyBlock(bytearray(self._read_acct(name, idx)), [])
+            with self.dirty_lock:
+                block.under(base)
+
+        with self.dirty_lock:
+            block.write(start, chunk)
+
+    def _buffered_block(self, name: str, idx: int) -> Optional[bytes]:
+        """a block we hold newer contents for than the chain, dirty or unconfirmed
+
+        None if there isnt one or we only hold the parts of it that were written
+        """
+        with self.dirty_lock:
+            block = self.dirty.get(name, {}).get(idx)
+            if block is None or not block.known:
+                pending = self.pending.get(self._block_key(name, idx))
+                block = None if pending is None else pending[0]
+            return bytes(block.data) if block is not None and block.known else None
+
+    def _dirty_bytes(self) -> int:
+        with self.dirty_lock:
+            return sum(len(b) for b in self.dirty.values()) * self.storage_size
+
+    def flush_file(self, name: str):
+        """send each dirty block of `name` to chain once, a group at a time
+
+        this doesnt wait on the groups to be confirmed, see sync_file
+        """
+        with self._file_lock(name):
+            unknown_holes = self._unknown_holes(name)
+            with self.dirty_lock:
+                holes = self.unprovisioned.get(name, set())
+                blocks = self.dirty.get(name, {})
+                # a hole thats still all zeros has nothing worth storing
+                for idx in [i for i in blocks if i in holes and _zero(blocks[i].data)]:
+                    del blocks[idx]
+                idxs = [idx for idx in blocks if idx in holes]
+                if unknown_holes:
+                    # any block we havent read could be a hole, _create_accts
+                    # skips the ones that turn out to have an account
+                    idxs = list(blocks)
+
+            if idxs:
+                self._create_accts(name, sorted(idxs))
+                with self.dirty_lock:
+                    holes.difference_update(idxs)
+                self.refresh_file(name)
+
+            with self.dirty_lock:
+                sending = {idx: blocks[idx].snapshot() for idx in sorted(blocks)}
+                length = self.resize_to.get(name)
+
+            # as many blocks to a group as their writes fit in
+            groups: list[dict[int, DirtyBlock]] = []
+            for idx, block in sending.items():
+                if not groups or _num_txns({**groups[-1], idx: block}) > MAX_GROUP_SIZE:
+                    groups.append({})
+                groups[-1][idx] = block
+            if length is not None and (
+                not groups or _num_txns(groups[-1]) == MAX_GROUP_SIZE
+            ):
+                groups.append({})
+
+            for num, group in enumerate(groups):
+                # hands the blocks over from dirty to pending once sent, a
+                # failure leaves the rest dirty. The new length rides along
+                # with the last of them so it never gets ahead of the data
+                last = num == len(groups) - 1
+                self._write_accts(name, group, length if last else None)
+
+            with self.dirty_lock:
+                if not self.dirty.get(name):
+                    self.dirty.pop(name, None)
+                    self.dirty_since.pop(name, None)
+
+    def sync_file(self, name: str):
+        """flush `name` and wait for everything sent for it to be confirmed"""
+        self.flush_file(name)
+
+        with self.dirty_lock:
+            futures = self.submitted.pop(name, [])
+        wait(futures)
+
+        with self.dirty_lock:
+            err = self.write_errors.pop(name, None)
+        if err is not None:
+            # the blocks went back to dirty, the next flush sends them again
+            raise err
+
+    def flush_all(self):
+        """sync every file with something buffered, one failing doesnt stop the rest
+
+        raises the first error once theyve all been tried
+        """
+        with self.dirty_lock:
+            names = set(self.dirty) | set(self.resize_to) | set(self.submitted)
+        first: Optional[Exception] = None
+        for name in names:
             try:
-                # copy  everything from cursor on
+                self.sync_file(name)
+            except Exception as e:
+                logging.error(f"sync of {name} failed: {e}")
+                first = first or e
+        if first is not None:
+            raise first
 
-                to_write = buf[cursor:]
+    def _writeback_loop(self):
+        """flush files whose dirty blocks have waited longer than writeback_age"""
+        while True:
+            time.sleep(self.writeback_age / 2)
+            now = time.monotonic()
+            with self.dirty_lock:
+                stale = [
+                    name
+                    for name, since in self.dirty_since.items()
+                    if now - since > self.writeback_age
+                ]
+            for name in stale:
+                try:
+                    self.flush_file(name)
+                except Exception as e:
+                    logging.error(f"background flush of {name} failed: {e}")
 
-                if box_idx == start_box and start_offset > 0:
-                    curr_data = self._read_acct(name, box_idx)
-                    # take -start_offset bytes from the to_write buffer since we want to fill out
-                    to_write = curr_data[:start_offset] + to_write[start_offset:]
-                    # update our cursor to show we read this many bytes
-                    cursor += start_offset
+    def truncate_file(self, name: str, length: int):
+        """grow `name` with zeros or cut it off at `length`
 
-                elif box_idx == stop_box and stop_offset > 0:
-                    curr_data = self._read_acct(name, box_idx)
-                    to_write = to_write[:stop_offset] + curr_data[stop_offset:]
-                    cursor += stop_offset
+        shrinking keeps the blocks past the end, they are zeroed so whatever
+        grows into them later reads as zeros, and an editor truncating a file
+        to rewrite it doesnt have to pay for new storage accounts
+        """
+        with self._file_lock(name):
+            self.file_exists(name)
+            size = self._stat_of(name).st_size
+            if length >= size:
+                # everything past the old end is already zeros or a hole
+                self._set_length(name, length)
+                return
 
-                to_write = to_write[: self.storage_size]
+            for box_idx in range(length // self.storage_size, self._blocks(size)):
+                start = max(length - box_idx * self.storage_size, 0)
+                self._buffer_write(
+                    name,
+                    box_idx,
+                    start,
+                    bytes(self.storage_size - start),
+                    self._is_hole(name, box_idx),
+                )
+            self._set_length(name, length)
 
-                logging.info(f"{box_idx}: {start_offset}:{stop_offset}, {cursor}")
+    def delete_file(self, name: str):
+        with self._file_lock(name):
+            # refresh cache if its gone stale
+            self.file_exists(name)
+            self._drop_blocks(name)
+            self.index.forget(self._index_key(name))
+            self.index.invalidate()
 
-                if len(to_write) == 0:
-                    return cursor
+            with self.dirty_lock:
+                self.ids.pop(name, None)
+            self.readahead.pop(name, None)
+            self.forget(name)
 
-                logging.debug(f"about to write: {len(to_write)}")
-                self._write_acct(name, box_idx, to_write)
+    def rename_file(self, old: str, new: str):
+        """list `old` under `new`, replacing whatever file was there
+
+        the file keeps its id and with it its storage accounts, so this is one
+        call to the app however big the file is. A file it replaces has its
+        accounts closed out after, like a delete
+        """
+        old_key, new_key = self._index_key(old), self._index_key(new)
+        # in name order, so two renames of the same pair cant deadlock
+        first, second = sorted([old, new])
+        with self._file_lock(first), self._file_lock(second):
+            if not self.file_exists(old):
+                raise FileNotFoundError(errno.ENOENT, "no such file", old)
+            if old == new:
+                return
+            # what was written under the old name has to land first
+            self.sync_file(old)
+            replaced = self.file_exists(new)
+
+            old_listing = self._index_address(old)
+            new_listing = self._index_address(new)
+            try:
+                atc = AtomicTransactionComposer()
+                self.app_client.add_method_call(
+                    atc,
+                    NFTP.rename,
+                    old=old_key,
+                    new=new_key,
+                    old_listing=old_listing,
+                    new_listing=new_listing,
+                )
+                self.pipeline.submit(atc).result()
             except Exception as e:
-                logging.error(f"Failed to write: {e}")
+                logging.error(f"rename of {old} failed: {e}")
+                if not replaced:
+                    # give back the slot it was placed in
+                    self.index.forget(new_key)
                 raise e
+            self.index.forget(old_key)
+            self.index.invalidate()
 
-        return len(buf)
+            if replaced:
+                # nothing lists its blocks now, close_out leaves the index be
+                self._drop_blocks(new)
+            fst = self.files[old]
+            with self.dirty_lock:
+                self.ids[new] = self.ids.pop(old)
+                holes = self.unprovisioned.pop(old, None)
+                if holes is not None:
+                    self.unprovisioned[new] = holes
+            self.readahead.pop(old, None)
+            self.readahead.pop(new, None)
 
-    def delete_file(self, name: str):
-        # refresh cache
-        self.file_exists(name)
-        for idx in range(self.files[name].num_boxes + 1):
+            self.forget(old)
+            with self._lookup_lock(new), self.files_lock:
+                self._remember({new: fst})
+
+    def _drop_blocks(self, name: str):
+        """throw away anything buffered for `name` and close out its storage accounts"""
+        unknown_holes = self._unknown_holes(name)
+
+        with self.dirty_lock:
+            self.dirty.pop(name, None)
+            self.dirty_since.pop(name, None)
+            unprovisioned = self.unprovisioned.pop(name, set())
+            self.resize_to.pop(name, None)
+            futures = self.submitted.pop(name, [])
+        # writes still in flight would land on closed out accounts
+        wait(futures)
+        with self.dirty_lock:
+            self.dirty.pop(name, None)
+            self.write_errors.pop(name, None)
+
+        idxs = [
+            idx for idx in range(self.files[name].num_boxes) if idx not in unprovisioned
+        ]
+        if unknown_holes:
+            idxs = [
+                idx
+                for idx, (_, opted_in) in zip(idxs, self._lookup_accts(name, idxs))
+                if opted_in
+            ]
+        for idx in idxs:
             self._delete_acct(name, idx)
+        with self.dirty_lock:
+            self.generations.pop(self.ids[name], None)
 
-        del self.files[name]
+    def _block_key(self, name: str, idx: int) -> tuple[int, bytes, int]:
+        return (self.app_client.app_id, self.ids[name], idx)
 
     def _read_acct(self, name: str, idx: int) -> bytes:
-        acct = self._storage_account(name, idx)
-        logging.debug(f"{acct.lsig.address()}")
+        if self._is_hole(name, idx):
+            return bytes(self.storage_size)
+
+        key = self._block_key(name, idx)
+        cached = self.block_cache.get(key)
+        if cached is not None:
+            return cached
+
+        prefetched = self._wait_inflight(key)
+        if prefetched is not None:
+            return prefetched
+
+        return self._fetch_acct(name, idx)
+
+    def _fetch_acct(self, name: str, idx: int) -> bytes:
+        """read a block from chain into the block cache"""
+        return self.io.run(self._fetch_acct_async(name, idx))
+
+    async def _prefetch_acct(self, fetch: Coroutine) -> bytes:
+        async with self.prefetch_slots:
+            return await fetch
+
+    async def _fetch_acct_async(self, name: str, idx: int) -> bytes:
+        # the chain doesnt have what we sent yet
+        buffered = self._buffered_block(name, idx)
+        if buffered is not None:
+            return buffered
+        key = self._block_key(name, idx)
+
+        start = time.monotonic()
+
+        addr = self._storage_address(name, idx)
+        logging.debug(f"{addr}")
+
+        try:
+            info = await self.aclient.account_application_info(
+                addr, self.app_client.app_id
+            )
+        except AlgodHTTPError as e:
+            if e.code != 404:
+                raise e
+            # no storage account, a hole someone else left in the file
+            with self.dirty_lock:
+                self.unprovisioned.setdefault(name, set()).add(idx)
+            return bytes(self.storage_size)
 
-        acct_state = self.app_client.get_account_state(acct.lsig.address(), raw=True)
+        acct_state = decode_state(
+            info.get("app-local-state", {}).get("key-value", []), raw=True
+        )
         # Make sure the blob is in the right order
-        return b"".join([acct_state[x.to_bytes(1, "big")] for x in range(9)])[
-            : self.storage_size
-        ]
+        data = b"".join(
+            [acct_state[x.to_bytes(1, "big")] for x in range(self.blob_pages)]
+        )[: self.storage_size]
+        with self.dirty_lock:
+            pending = self.pending.get(key)
+        if pending is not None:
+            # ranges sent but maybe not confirmed yet, applying them twice is fine
+            data = pending[0].apply(data)
+        self.block_cache.put(key, data)
+
+        elapsed = time.monotonic() - start
+        self.fetch_latency = (
+            elapsed
+            if self.fetch_latency == 0
+            else 0.75 * self.fetch_latency + 0.25 * elapsed
+        )
+        return data
 
     def _delete_acct(self, name: str, idx: int):
         lsig_signer = self._storage_account(name, idx)
@@ -184,60 +1031,362 @@ class AlgorandStorageManager(StorageManager):
 
         deets = self._file_block_details(name, idx)
 
+        self._wait_inflight(self._block_key(name, idx))
+        self.block_cache.invalidate(self._block_key(name, idx))
         self.app_client.call(
-            NFTP.delete, deets=deets, storage_account=lsig_signer.lsig.address()
+            NFTP.delete, deets=deets, storage_account=self._storage_address(name, idx)
+        )
+        lsig_client.close_out(
+            deets=deets,
+            fname=self._index_key(name),
+            listing=self._index_address(name),
         )
-        lsig_client.close_out(deets=deets)
 
     def _create_acct(self, name: str, idx: int):
+        self._create_accts(name, [idx])
+
+    def _create_accts(self, name: str, idxs: list[int]):
+        """fund and opt in the storage accounts for `idxs`
+
+        existing accounts are looked up concurrently and skipped, the rest are
+        paid for and opted in MAX_GROUP_SIZE transactions at a time with the
+        funding account covering every fee in the group
+        """
+        addrs = dict(zip(idxs, self._storage_addresses(name, idxs)))
+
         try:
+            listing = self._index_address(name)
+            todo = [
+                (idx, not funded)
+                for idx, (funded, opted_in) in zip(idxs, self._lookup_accts(name, idxs))
+                if not opted_in
+            ]
 
-            lsig_signer = self._storage_account(name, idx)
-            lsig_addr = lsig_signer.lsig.address()
+            sender = self.app_client.get_sender()
+            signer = self.app_client.get_signer()
+            per_group = MAX_GROUP_SIZE // 2
+            # every group goes out before we wait on any of them
+            sent: list[tuple[list[tuple[int, bool]], Future]] = []
+            for start in range(0, len(todo), per_group):
+                group = todo[start : start + per_group]
+                num_txns = sum(2 if fund else 1 for _, fund in group)
 
-            ai = self.app_client.client.account_info(lsig_addr)
-            if "amount" in ai and ai["amount"] > 0:
-                return
+                sp = self.app_client.get_suggested_params()
+                atc = AtomicTransactionComposer()
+                for idx, fund in group:
+                    lsig_addr = addrs[idx]
+                    if fund:
+                        atc.add_transaction(
+                            TransactionWithSigner(
+                                PaymentTxn(
+                                    sender,
+                                    self._pooled_fee(sp, atc, num_txns),
+                                    lsig_addr,
+                                    bkr.consts.algo * 2,
+                                ),
+                                signer,
+                            )
+                        )
+                    self.app_client.add_method_call(
+                        atc,
+                        NFTP.opt_in,
+                        sender=lsig_addr,
+                        signer=self._storage_account(name, idx),
+                        suggested_params=self._pooled_fee(sp, atc, num_txns),
+                        on_complete=OnComplete.OptInOC,
+                        rekey_to=self.app_client.app_addr,
+                        deets=self._file_block_details(name, idx),
+                        fname=self._index_key(name),
+                        listing=listing,
+                    )
+                sent.append((group, self._submit_bumping(name, atc, len(group))))
 
-            lsig_client = self.app_client.prepare(lsig_signer)
-            self.app_client.fund(bkr.consts.algo * 2, addr=lsig_addr)
-            lsig_client.opt_in(
-                deets=self._file_block_details(name, idx),
-                rekey_to=self.app_client.app_addr,
-            )
+            for group, future in sent:
+                future.result()
+                # the entry changed, dont answer from global state read before
+                self.index.invalidate()
+                for idx, _ in group:
+                    # opt in zeroes the blob, no need to ask for it
+                    self.block_cache.put(
+                        self._block_key(name, idx), bytes(self.storage_size)
+                    )
         except Exception as e:
             logging.error(f"cant create account: {e}")
             raise e
 
-    def _write_acct(self, name: str, idx: int, data: bytes):
-        try:
-            lsig_signer = self._storage_account(name, idx)
-            deets = self._file_block_details(name, idx)
-            self.app_client.call(
-                NFTP.write,
-                deets=deets,
-                data=data,
-                storage_account=lsig_signer.lsig.address(),
+    def _index_address(self, name: str) -> str:
+        """the account `name` is listed in, opening a new index account for it if need be"""
+        shard = self.index.locate(self._index_key(name))
+        if shard is APP:
+            return self.app_client.app_addr
+        if not self.index.opened(shard):
+            self._open_shard(shard)
+        return self.index.address(shard)
+
+    def _open_shard(self, shard: int):
+        """fund and opt in the index account for `shard`"""
+        addr = self.index.address(shard)
+        sp = self.app_client.get_suggested_params()
+        atc = AtomicTransactionComposer()
+        atc.add_transaction(
+            TransactionWithSigner(
+                PaymentTxn(
+                    self.app_client.get_sender(),
+                    self._pooled_fee(sp, atc, 2),
+                    addr,
+                    bkr.consts.algo * 2,
+                ),
+                self.app_client.get_signer(),
             )
+        )
+        self.app_client.add_method_call(
+            atc,
+            NFTP.opt_in,
+            sender=addr,
+            signer=self.index.signer(shard),
+            suggested_params=self._pooled_fee(sp, atc, 2),
+            on_complete=OnComplete.OptInOC,
+            rekey_to=self.app_client.app_addr,
+            deets=[index_name, shard],
+            fname=b"",
+            listing=addr,
+        )
+        self.pipeline.submit(atc).result()
+        self.index.invalidate()
+
+    def _lookup_accts(self, name: str, idxs: list[int]) -> list[tuple[bool, bool]]:
+        """whether each storage account is funded and opted in, looked up concurrently"""
+        addrs = self._storage_addresses(name, idxs)
+        app_id = self.app_client.app_id
+
+        async def lookup(addr: str) -> tuple[bool, bool]:
+            ai = await self.aclient.account_info(addr)
+            funded = ai.get("amount", 0) > 0
+            opted_in = any(a["id"] == app_id for a in ai.get("apps-local-state", []))
+            return funded, opted_in
+
+        async def lookup_all() -> list[tuple[bool, bool]]:
+            return await asyncio.gather(*(lookup(addr) for addr in addrs))
+
+        return self.io.run(lookup_all())
+
+    def _pooled_fee(
+        self, sp: SuggestedParams, atc: AtomicTransactionComposer, num_txns: int
+    ) -> SuggestedParams:
+        """params for the next txn in `atc`, the first one pays for all `num_txns`"""
+        params = copy(sp)
+        params.flat_fee = True
+        params.fee = sp.min_fee * num_txns if atc.get_tx_count() == 0 else 0
+        return params
+
+    def _write_accts(
+        self, name: str, blocks: dict[int, DirtyBlock], length: Optional[int] = None
+    ) -> Future:
+        """send up to MAX_GROUP_SIZE block writes as a single atomic group
+
+        the first transaction pays the fee for the whole group so the rest can
+        go out with a zero fee. Returns once algod has the group, the blocks
+        move from dirty to pending until the future says it was confirmed.
+        Blocks we hold go out a page at a time, pages of up to
+        ACCOUNTS_PER_CALL blocks sharing each write_pages call, the rest with
+        a write_range per range. A `length` is set on the file in the same
+        group, taking up one of the transactions
+        """
+        num_txns = _num_txns(blocks) + (length is not None)
+        assert num_txns <= MAX_GROUP_SIZE
+
+        # a block still waiting on an earlier group has to land first
+        with self.dirty_lock:
+            earlier = {
+                self.pending[key][1]
+                for key in (self._block_key(name, idx) for idx in blocks)
+                if key in self.pending
+            }
+        wait(earlier)
+
+        sp = self.app_client.get_suggested_params()
+        atc = AtomicTransactionComposer()
+        try:
+            fname = self._index_key(name)
+            listing = self._index_address(name)
+            for idx, block in sorted(blocks.items()):
+                if block.known:
+                    continue
+                for lo, hi in block.ranges:
+                    self.app_client.add_method_call(
+                        atc,
+                        NFTP.write_range,
+                        suggested_params=self._pooled_fee(sp, atc, num_txns),
+                        deets=self._file_block_details(name, idx),
+                        start=lo,
+                        data=bytes(block.data[lo:hi]),
+                        storage_account=self._storage_address(name, idx),
+                        fname=fname,
+                        listing=listing,
+                    )
+            for call in _page_calls(blocks):
+                # foreign accounts in the order the call first mentions them
+                idxs = list(dict.fromkeys(idx for idx, _ in call))
+                writes = []
+                for idx, page in call:
+                    lo = page * blob_page_size
+                    data = bytes(blocks[idx].data[lo : lo + blob_page_size])
+                    # the last page runs past the block, pad it out
+                    writes.append(
+                        [idxs.index(idx) + 1, page, data.ljust(blob_page_size, b"\0")]
+                    )
+                self.app_client.add_method_call(
+                    atc,
+                    NFTP.write_pages,
+                    suggested_params=self._pooled_fee(sp, atc, num_txns),
+                    accounts=self._storage_addresses(name, idxs),
+                    writes=writes,
+                    fname=fname,
+                    listing=listing,
+                )
+            if length is not None:
+                self.app_client.add_method_call(
+                    atc,
+                    NFTP.resize,
+                    suggested_params=self._pooled_fee(sp, atc, num_txns),
+                    fname=fname,
+                    length=length,
+                    listing=listing,
+                )
+            confirmed = self._submit_bumping(name, atc, _num_txns(blocks))
         except Exception as e:
             logging.error(f"error in write: {e}")
             raise e
 
-    def _file_block_details(self, name: str, idx: int) -> list[str | int]:
-        return [bytes(32 - len(name)) + name.encode(), idx]
+        # settles only after _write_done, so whoever waits on it sees failed
+        # blocks back in dirty
+        future: Future = Future()
+        with self.dirty_lock:
+            dirty = self.dirty.get(name, {})
+            for idx, block in blocks.items():
+                self.pending[self._block_key(name, idx)] = (block, future)
+                if dirty.get(idx) == block:
+                    del dirty[idx]
+            if length is not None:
+                if self.resize_to.get(name) == length:
+                    del self.resize_to[name]
+                self.resizing[name] = (length, future)
+            submitted = self.submitted.setdefault(name, [])
+            submitted[:] = [f for f in submitted if not f.done()] + [future]
+
+        for idx, block in blocks.items():
+            key = self._block_key(name, idx)
+            # dont let an older prefetch land on top of what we just wrote
+            self._wait_inflight(key)
+            # a block we didnt read is only worth caching if the rest is cached
+            base = (
+                bytes(self.storage_size) if block.known else self.block_cache.get(key)
+            )
+            if base is not None:
+                self.block_cache.put(key, block.apply(base))
+
+        confirmed.add_done_callback(
+            lambda f: self._write_done(name, blocks, f, future, length)
+        )
+        return future
+
+    def _write_done(
+        self,
+        name: str,
+        blocks: dict[int, DirtyBlock],
+        confirmed: Future,
+        future: Future,
+        length: Optional[int] = None,
+    ):
+        """called once the group writing `blocks` is confirmed or has failed"""
+        err = confirmed.exception()
+        if err is not None:
+            logging.error(f"write of {name} failed: {err}")
+
+        with self.dirty_lock:
+            for idx, block in blocks.items():
+                key = self._block_key(name, idx)
+                if key not in self.pending or self.pending[key][1] is not future:
+                    # sent again since
+                    continue
+                del self.pending[key]
+
+                if err is not None:
+                    # back to dirty for the next flush, under anything written since
+                    dirty = self.dirty.setdefault(name, {})
+                    if idx in dirty:
+                        dirty[idx].under(block)
+                    else:
+                        dirty[idx] = block
+                    self.dirty_since.setdefault(name, time.monotonic())
+
+            if length is not None and self.resizing.get(name, (0, None))[1] is future:
+                del self.resizing[name]
+                # the length in global state may have been read before this
+                self.index.invalidate()
+                if err is not None:
+                    # same again, unless its been resized since
+                    self.resize_to.setdefault(name, length)
+                    self.dirty_since.setdefault(name, time.monotonic())
+
+            if err is not None:
+                self.write_errors[name] = err
+
+        if err is not None:
+            future.set_exception(err)
+        else:
+            future.set_result(confirmed.result())
+
+    def _submit_bumping(
+        self, name: str, atc: AtomicTransactionComposer, count: int
+    ) -> Future:
+        """submit a group with `count` calls bumping the generation of `name`
+
+        theyre counted from before the group goes out, a stat read while its
+        confirming may have them already
+        """
+        with self.dirty_lock:
+            file_id = self.ids[name]
+            self.bumping[file_id] = self.bumping.get(file_id, 0) + count
+        try:
+            confirmed = self.pipeline.submit(atc)
+        except Exception as e:
+            self._bumped(file_id, count, False)
+            raise e
+        confirmed.add_done_callback(
+            lambda f: self._bumped(file_id, count, f.exception() is None)
+        )
+        return confirmed
+
+    def _bumped(self, file_id: bytes, count: int, landed: bool):
+        """the group of `count` bumps settled, if it `landed` our blocks have them"""
+        with self.dirty_lock:
+            left = self.bumping.pop(file_id) - count
+            if left:
+                self.bumping[file_id] = left
+            if landed and file_id in self.generations:
+                self.generations[file_id] += count
+
+    def _file_block_details(self, name: str, idx: int) -> list[bytes | int]:
+        return [self.ids[name], idx]
 
     def _storage_account(self, name: str, idx: int) -> LogicSigTransactionSigner:
-        app = cast(NFTP, self.app_client.app)
         try:
-            deets = self._file_block_details(name, idx)
-            deets.append(self.app_client.app_id)
-            val = app.tmpl_account.template_signer(*deets)
+            file_id, idx = self._file_block_details(name, idx)
+            val = self.storage_accounts.signer(file_id, idx)
         except Exception as e:
             logging.error(f"wat: {e}")
             raise e
         return val
 
-    def _acct_addr_seq(self, addr: str) -> tuple[str, int]:
+    def _storage_address(self, name: str, idx: int) -> str:
+        file_id, idx = self._file_block_details(name, idx)
+        return self.storage_accounts.address(file_id, idx)
+
+    def _storage_addresses(self, name: str, idxs: list[int]) -> list[str]:
+        return self.storage_accounts.addresses(self.ids[name], idxs)
+
+    def _acct_addr_seq(self, addr: str) -> tuple[bytes, int]:
         state = self.app_client.get_account_state(addr)
         return storage_deets_codec.decode(state["deets"])
 
@@ -0,0 +1,406 @@
+"""Benchmark NftpFS operations against the fake algod
+
+Drives the NftpFS handlers directly (no kernel mount) through a few
+workloads that look like what the shell does to a mount, and records per
+FUSE op latency, throughput and how many storage manager / algod calls
+each workload cost.
+
+    python bench.py --rtt 0.002 --out bench.json
+    python bench.py --rtt 0.002 --baseline bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict
+from threading import Lock
+from typing import Callable
+
+from algorand.fake_algod import FakeAlgod
+from algorand_storage_manager import AlgorandStorageManager
+from nftp import NftpFS
+
+# storage manager methods whose calls we count for each scenario
+COUNTED_CALLS = [
+    "list_pages",
+    "find_file",
+    "_read_acct",
+    "_fetch_acct_async",
+    "_write_accts",
+    "_create_acct",
+    "_create_accts",
+]
+
+IO_SIZE = 4096
+
+
+class Bench:
+    """wraps an NftpFS so every handler call is timed and counted"""
+
+    def __init__(self, fs: NftpFS, fake: FakeAlgod):
+        self.fs = fs
+        self.fake = fake
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.calls: Counter[str] = Counter()
+        self.errors = 0
+        self.bytes = 0
+        # scenarios may drive the fs from several threads, like fuse does
+        self.lock = Lock()
+
+        manager = fs.storage_manager
+        for name in COUNTED_CALLS:
+            setattr(manager, name, self._counted(name, getattr(manager, name)))
+
+    def _counted(self, name: str, fn: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            with self.lock:
+                self.calls[name] += 1
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    def op(self, name: str, *args):
+        return self._timed(name, getattr(self.fs, name), *args)
+
+    def open(self, path: str, flags: int):
+        """open a file the way fuse does, through the file class"""
+        return self._timed("open", self.fs.file_class, path, flags)
+
+    def fop(self, fh, name: str, *args):
+        """call `name` on an open file"""
+        if fh is None:
+            with self.lock:
+                self.errors += 1
+            return None
+        return self._timed(name, getattr(fh, name), *args)
+
+    def _timed(self, name: str, fn: Callable, *args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+            if name == "readdir":
+                result = list(result)
+        except Exception as e:
+            logging.error(f"bench {name}{args[:1]} failed: {e}")
+            with self.lock:
+                self.errors += 1
+            result = None
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if name == "read" and isinstance(result, bytes):
+                self.bytes += len(result)
+            elif name == "write" and isinstance(result, int):
+                self.bytes += result
+        return result
+
+    def reset(self):
+        self.latencies.clear()
+        self.calls.clear()
+        self.errors = 0
+        self.bytes = 0
+        self.fake.reset_counters()
+
+        # start every scenario cold, like dropping the page cache before a run
+        self.fs.storage_manager.invalidate()
+        cache = getattr(self.fs.storage_manager, "block_cache", None)
+        if cache is not None:
+            cache.clear()
+            cache.hits = cache.misses = cache.evictions = 0
+
+    def report(self, wall: float) -> dict:
+        ops = {}
+        for name, samples in sorted(self.latencies.items()):
+            ops[name] = {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p90_ms": percentile(samples, 90) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "max_ms": max(samples) * 1000,
+            }
+        return {
+            "wall_s": wall,
+            "ops": ops,
+            "bytes": self.bytes,
+            "throughput_bps": self.bytes / wall if wall > 0 else 0.0,
+            "ops_per_s": sum(o["count"] for o in ops.values()) / wall if wall else 0.0,
+            "calls": {name: self.calls[name] for name in COUNTED_CALLS},
+            "algod_requests": dict(self.fake.requests),
+            "algod_requests_total": sum(self.fake.requests.values()),
+            "txns": dict(self.fake.txns),
+            "block_cache": self._cache_stats(),
+            "errors": self.errors,
+        }
+
+    def _cache_stats(self) -> dict:
+        cache = getattr(self.fs.storage_manager, "block_cache", None)
+        return {} if cache is None else cache.stats()
+
+
+def percentile(samples: list[float], pct: int) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[idx]
+
+
+def copy_in(bench: Bench, path: str, data: bytes):
+    """what `cp` does to a file that isnt on the mount yet"""
+    bench.op("getattr", path)
+    bench.op("mknod", path, 0o100644, 0)
+    fh = bench.open(path, os.O_WRONLY)
+    for offset in range(0, len(data), IO_SIZE):
+        bench.fop(fh, "write", data[offset : offset + IO_SIZE], offset)
+    close(bench, fh)
+    bench.op("getattr", path)
+
+
+def close(bench: Bench, fh):
+    bench.fop(fh, "flush")
+    bench.fop(fh, "release", 0)
+
+
+def ls_dir(bench: Bench):
+    """what `ls -l` does to the root"""
+    bench.op("getattr", "/")
+    for entry in bench.op("readdir", "/", 0) or []:
+        if entry.name not in (".", ".."):
+            bench.op("getattr", "/" + entry.name)
+
+
+#
+# scenarios, each gets a fresh fake chain and sets up what it needs before
+# the counters are reset
+#
+
+
+def ls_l(bench: Bench, args):
+    for idx in range(args.files):
+        bench.fs.storage_manager.create_file(f"f{idx:03d}", 0o100644, 0)
+
+    yield
+    ls_dir(bench)
+
+
+def cp(bench: Bench, args):
+    data = load_data(args)
+    yield
+    copy_in(bench, "/data.mp3", data)
+
+
+def seq_read(bench: Bench, args):
+    data = load_data(args)
+    copy_in(bench, "/data.mp3", data)
+    yield
+    fh = bench.open("/data.mp3", os.O_RDONLY)
+    for offset in range(0, len(data), IO_SIZE):
+        bench.fop(fh, "read", IO_SIZE, offset)
+
+
+def random_read(bench: Bench, args):
+    data = load_data(args)
+    copy_in(bench, "/data.mp3", data)
+    rand = random.Random(args.seed)
+    yield
+    fh = bench.open("/data.mp3", os.O_RDONLY)
+    for _ in range(len(data) // IO_SIZE):
+        offset = rand.randrange(0, len(data) // IO_SIZE) * IO_SIZE
+        bench.fop(fh, "read", IO_SIZE, offset)
+
+
+def overwrite(bench: Bench, args):
+    data = load_data(args)
+    copy_in(bench, "/data.mp3", data)
+    data = bytes(reversed(data))
+    yield
+    bench.op("getattr", "/data.mp3")
+    fh = bench.open("/data.mp3", os.O_WRONLY)
+    for offset in range(0, len(data), IO_SIZE):
+        bench.fop(fh, "write", data[offset : offset + IO_SIZE], offset)
+    close(bench, fh)
+
+
+def parallel(bench: Bench, args):
+    """readers on separate files while another thread lists the mount"""
+    data = load_data(args)
+    paths = [f"/data{idx}.mp3" for idx in range(4)]
+    for path in paths:
+        copy_in(bench, path, data)
+    yield
+
+    def reader(path: str):
+        fh = bench.open(path, os.O_RDONLY)
+        for offset in range(0, len(data), IO_SIZE):
+            bench.fop(fh, "read", IO_SIZE, offset)
+        bench.fop(fh, "release", 0)
+
+    def lister():
+        for _ in range(16):
+            ls_dir(bench)
+
+    with ThreadPoolExecutor(max_workers=len(paths) + 1) as pool:
+        futures = [pool.submit(reader, path) for path in paths]
+        futures.append(pool.submit(lister))
+        for future in futures:
+            future.result()
+
+
+def sparse(bench: Bench, args):
+    """an image preallocated with truncate and only written at either end"""
+    data = load_data(args)[:IO_SIZE]
+    size = 256 * 1024
+    bench.op("mknod", "/disk.img", 0o100644, 0)
+    yield
+    fh = bench.open("/disk.img", os.O_WRONLY)
+    bench.fop(fh, "ftruncate", size)
+    bench.fop(fh, "write", data, 0)
+    bench.fop(fh, "write", data, size - IO_SIZE)
+    close(bench, fh)
+
+    fh = bench.open("/disk.img", os.O_RDONLY)
+    for offset in range(0, size, IO_SIZE):
+        bench.fop(fh, "read", IO_SIZE, offset)
+
+
+def patch(bench: Bench, args):
+    """small unaligned edits scattered over a file thats on chain but not cached"""
+    data = load_data(args)
+    copy_in(bench, "/data.mp3", data)
+    rand = random.Random(args.seed)
+    yield
+    fh = bench.open("/data.mp3", os.O_WRONLY)
+    for _ in range(64):
+        offset = rand.randrange(0, len(data) - 64)
+        bench.fop(fh, "write", rand.randbytes(rand.randrange(1, 64)), offset)
+    close(bench, fh)
+
+
+SCENARIOS = {
+    "ls_l": ls_l,
+    "cp": cp,
+    "seq_read": seq_read,
+    "random_read": random_read,
+    "overwrite": overwrite,
+    "parallel": parallel,
+    "sparse": sparse,
+    "patch": patch,
+}
+
+
+def load_data(args) -> bytes:
+    with open(args.data, "rb") as f:
+        return f.read()
+
+
+def run(args) -> dict:
+    results = {}
+    for name in args.scenarios:
+        fake = FakeAlgod(
+            rtt=args.rtt,
+            block_time=args.block_time,
+            failure_rate=args.failure_rate,
+            seed=args.seed,
+        )
+        if args.http:
+            # go through the real keep-alive transports
+            fake.serve()
+        manager = AlgorandStorageManager(fake.create_app_client(args.block_size))
+        bench = Bench(NftpFS(storage_manager=manager), fake)
+
+        scenario = SCENARIOS[name](bench, args)
+        # everything before the first yield is setup
+        next(scenario)
+        bench.reset()
+
+        start = time.perf_counter()
+        for _ in scenario:
+            pass
+        results[name] = bench.report(time.perf_counter() - start)
+
+    return {
+        "config": {
+            "rtt": args.rtt,
+            "block_time": args.block_time,
+            "failure_rate": args.failure_rate,
+            "files": args.files,
+            "data": args.data,
+            "seed": args.seed,
+            "http": args.http,
+            "block_size": args.block_size,
+        },
+        "scenarios": results,
+    }
+
+
+def compare(baseline: dict, current: dict) -> bool:
+    """print deltas against a previous run, returns True if chain calls regressed"""
+    regressed = False
+    for name, cur in current["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        base = baseline["scenarios"][name]
+        print(
+            f"{name}: wall {base['wall_s']:.3f}s -> {cur['wall_s']:.3f}s, "
+            f"algod requests {base['algod_requests_total']} -> {cur['algod_requests_total']}"
+        )
+        for call in COUNTED_CALLS:
+            before, after = base["calls"].get(call, 0), cur["calls"].get(call, 0)
+            if after != before:
+                print(f"    {call}: {before} -> {after}")
+
+        if cur["algod_requests_total"] > base["algod_requests_total"]:
+            print(f"    REGRESSION: {name} makes more algod requests")
+            regressed = True
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark NftpFS operations")
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+        help="scenarios to run",
+    )
+    parser.add_argument("--rtt", type=float, default=0.0, help="algod rtt, seconds")
+    parser.add_argument(
+        "--block_time", type=float, default=0.0, help="seconds per round"
+    )
+    parser.add_argument(
+        "--failure_rate", type=float, default=0.0, help="chance a request fails"
+    )
+    parser.add_argument("--files", type=int, default=64, help="files for ls_l")
+    parser.add_argument("--data", type=str, default="data.mp3", help="file to copy")
+    parser.add_argument("--seed", type=int, default=0, help="rng seed")
+    parser.add_argument(
+        "--block_size", type=int, default=1024, help="bytes per storage account"
+    )
+    parser.add_argument(
+        "--http", action="store_true", help="serve the fake algod over local http"
+    )
+    parser.add_argument("--out", type=str, help="write json results here")
+    parser.add_argument("--baseline", type=str, help="json results to compare with")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(json.load(f), results):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Hashable, Optional
+
+
+class BlockCache:
+    """LRU cache of storage block contents bounded by total bytes held
+
+    keys are whatever identifies a block for the storage manager, for algorand
+    that is (app_id, file_id, idx)
+    """
+
+    def __init__(self, max_bytes: int = 8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.blocks: OrderedDict[Hashable, bytes] = OrderedDict()
+        # prefetching fills the cache from worker threads
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.blocks
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self.lock:
+            data = self.blocks.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return data
+
+    def put(self, key: Hashable, data: bytes):
+        with self.lock:
+            self._drop(key)
+            if len(data) > self.max_bytes:
+                return
+
+            self.blocks[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.blocks.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            self._drop(key)
+
+    def _drop(self, key: Hashable):
+        data = self.blocks.pop(key, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "blocks": len(self.blocks),
+            "bytes": self.size,
+        }
@@ -15,12 +15,90 @@ def main():
 
     parser.add_argument("--algorand", action="store_true", help="run algorand engine")
     parser.add_argument("--algorand_appid", type=int, help="algorand appid", default=1)
+    parser.add_argument(
+        "--algorand_block_size",
+        type=int,
+        help="bytes each storage account holds, up to 1778, checked against the app",
+        default=1024,
+    )
+    parser.add_argument(
+        "--algorand_fake",
+        action="store_true",
+        help="run algorand engine against an in-process fake algod",
+    )
+    parser.add_argument(
+        "--algorand_fake_rtt",
+        type=float,
+        help="seconds of latency added to each fake algod request",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--block_cache_bytes",
+        type=int,
+        help="bytes of storage blocks to keep cached in memory",
+        default=8 * 1024 * 1024,
+    )
+    parser.add_argument(
+        "--readahead_blocks",
+        type=int,
+        help="most blocks to prefetch ahead of a sequential reader, 0 disables",
+        default=64,
+    )
+    parser.add_argument(
+        "--fetch_concurrency",
+        type=int,
+        help="most concurrent algod reads, each gets its own keep-alive connection",
+        default=16,
+    )
+    parser.add_argument(
+        "--algod_connections",
+        type=int,
+        help="keep-alive connections for blocking algod calls, not reads",
+        default=8,
+    )
+    parser.add_argument(
+        "--writeback_bytes",
+        type=int,
+        help="bytes of dirty blocks to buffer before flushing to chain",
+        default=4 * 1024 * 1024,
+    )
+    parser.add_argument(
+        "--writeback_age",
+        type=float,
+        help="seconds a dirty block may wait before being flushed, 0 disables",
+        default=5.0,
+    )
 
     parser.add_argument("--near", action="store_true", help="run near engine")
     parser.add_argument(
         "--near_account", type=str, help="near account", default="near.test"
     )
 
+    parser.add_argument(
+        "--attr_ttl",
+        type=float,
+        help="seconds to trust the cached file listing",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--negative_ttl",
+        type=float,
+        help="seconds to remember that a file does not exist",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--watch_chain",
+        action="store_true",
+        help="follow every round and drop only what other writers changed, "
+        "so cached stats can be kept far longer than --attr_ttl",
+    )
+    parser.add_argument(
+        "--max_io_bytes",
+        type=int,
+        help="largest read or write the kernel sends in one request",
+        default=128 * 1024,
+    )
+
     args, unknown = parser.parse_known_args()
 
     storage_manager = None
@@ -39,10 +117,25 @@ def main():
         storage_manager=storage_manager,
         version="%prog " + fuse.__version__,
         usage="Userspace Blockchain Mounted storage example:\n" + Fuse.fusage,
-        # idk what this does?
+        # -s still asks for single threaded dispatch, handy when debugging
         dash_s_do="setsingle",
     )
+    # managers are safe to call from many fuse threads, a slow algod call on
+    # one file shouldnt hold up the rest of the mount
+    server.multithreaded = True
     server.parse(unknown, errex=0)
+    # readdir and getattr hand out inodes derived from each file, keep them
+    server.fuse_args.add("use_ino")
+    # the kernel trusts names and stats as long as we do, and drops cached
+    # pages when a stat it refreshes shows the file changed
+    server.fuse_args.add("attr_timeout", str(args.attr_ttl))
+    server.fuse_args.add("entry_timeout", str(args.attr_ttl))
+    server.fuse_args.add("negative_timeout", str(args.negative_ttl))
+    server.fuse_args.add("auto_inval_data")
+    # fewer, bigger requests, so one read spans blocks that are fetched at once
+    server.fuse_args.add("big_writes")
+    server.fuse_args.add("max_read", str(args.max_io_bytes))
+    server.fuse_args.add("max_write", str(args.max_io_bytes))
     return server.main()
 
 
@@ -7,13 +7,15 @@ from nftp import StorageManager, FileStat
 
 
 class NearStorageManager(StorageManager):
-    def __init__(self, storage_size: int = 1024):
+    def __init__(self, storage_size: int = 1024, **kwargs):
         self.storage_size = storage_size
-        super().__init__()
+        super().__init__(**kwargs)
 
     @staticmethod
     def factory(args) -> "NearStorageManager":
-        return NearStorageManager()
+        return NearStorageManager(
+            attr_ttl=args.attr_ttl, negative_ttl=args.negative_ttl
+        )
 
     def list_files(self) -> dict[str, FileStat]:
         logging.info(f"{app_state}")
@@ -1,6 +1,11 @@
 from abc import ABC, abstractmethod
+from threading import RLock
+from typing import Iterator, Optional
 import logging
+import math
 import stat, errno
+import os
+import time
 import fuse
 from fuse import Fuse
 
@@ -10,13 +15,17 @@ fuse.fuse_python_api = (0, 2)
 class FileStat(fuse.Stat):
     """data structure returned from stat requests on files"""
 
-    def __init__(self, num_boxes: int):
+    def __init__(self, num_boxes: int, num_stored: Optional[int] = None):
         self.num_boxes = num_boxes
+        # blocks actually stored, fewer than num_boxes when the file has holes
+        self.num_stored = num_boxes if num_stored is None else num_stored
 
         # permissions
         self.st_mode = 0
-        # ??
+        # inode number, the kernel only uses it when mounted with use_ino
         self.st_ino = 0
+        # goes up whenever the contents change, on chains that count it
+        self.generation = 0
         # device id holding file
         self.st_dev = 0
         # number of links
@@ -35,29 +44,188 @@ class FileStat(fuse.Stat):
         self.st_ctime = 0
 
 
+class FileHandle:
+    """what a storage manager keeps around for one open of a file
+
+    the stat is resolved once on open so I/O through the handle doesnt go back
+    to the listing, managers hang whatever else they want to keep per open
+    (read ahead state, signers) off a subclass
+    """
+
+    def __init__(self, name: str, fst: FileStat, flags: int):
+        self.name = name
+        self.fst = fst
+        self.flags = flags
+        # set once writes through this handle need flushing
+        self.dirty = False
+
+
 class StorageManager(ABC):
-    """abstracts blockchain specific access to allow consistent api across chains"""
+    """abstracts blockchain specific access to allow consistent api across chains
+
+    keeps the stat of every file it looks up around for `attr_ttl` seconds and
+    remembers names that did not exist for `negative_ttl` seconds so the hot
+    getattr/open path doesnt go to the chain. Files are looked up by name,
+    only readdir goes through the whole listing and it takes it a page at a
+    time
 
-    def __init__(self):
-        self.files: dict[str, FileStat] = self.list_files()
+    fuse calls in from many threads at once, `files_lock` guards the cache
+    and is only held while it changes. Lookups of one name take a lock of
+    its own, so only one of them goes to the chain for it at a time while
+    lookups of other names go ahead
+
+    the kernel keeps pages of a file cached between opens as long as a
+    refresh hasnt turned up a change it didnt make itself, see keep_cache
+    """
+
+    def __init__(self, attr_ttl: float = 1.0, negative_ttl: float = 1.0):
+        self.attr_ttl = attr_ttl
+        self.negative_ttl = negative_ttl
+        self.files_lock = RLock()
+        # name -> lock held while looking it up on chain
+        self.lookup_locks: dict[str, RLock] = {}
+
+        self.files: dict[str, FileStat] = {}
+        # name -> time we fetched its stat
+        self.fetched: dict[str, float] = {}
+        # name -> time we last saw it missing
+        self.missing: dict[str, float] = {}
+        # name -> bumped whenever a refresh finds the file changed under us
+        self.versions: dict[str, int] = {}
+        # name -> version the file was at when it was last opened
+        self.opened: dict[str, int] = {}
 
     def file_names(self) -> list[str]:
-        return list(self.files.keys())
+        return [name for page in self.scan_files() for name in page]
 
     def file_exists(self, name: str) -> bool:
-        # refresh cache
-        self.files = self.list_files()
-        return name in self.files
+        asked = time.monotonic()
+        exists = self._cached(name)
+        if exists is not None:
+            return exists
+
+        with self._lookup_lock(name):
+            # someone else may have looked it up while we waited for the lock
+            exists = self._cached(name, asked)
+            if exists is None:
+                exists = self.refresh_file(name) is not None
+            return exists
+
+    def _lookup_lock(self, name: str) -> RLock:
+        with self.files_lock:
+            return self.lookup_locks.setdefault(name, RLock())
+
+    def _cached(self, name: str, asked: float = math.inf) -> Optional[bool]:
+        """whether `name` exists, if we looked recently enough to say
+
+        a lookup done since `asked` is recent enough, however short the ttls
+        """
+        now = time.monotonic()
+        fetched_at = self.fetched.get(name, 0.0)
+        if name in self.files and (
+            now - fetched_at < self.attr_ttl or fetched_at >= asked
+        ):
+            return True
+
+        missing_at = self.missing.get(name)
+        if missing_at is not None and (
+            now - missing_at < self.negative_ttl or missing_at >= asked
+        ):
+            return False
+        return None
 
     def file_stat(self, name: str):
         # reuse cached, this is called a lot
         # will raise key error, thats ok
         return self.files[name]
 
+    def refresh_file(self, name: str) -> Optional[FileStat]:
+        """fetch the stat of `name` from chain and reset its cache timer"""
+        with self._lookup_lock(name):
+            fst = self.find_file(name)
+            with self.files_lock:
+                if fst is None:
+                    self.files.pop(name, None)
+                    self.missing[name] = time.monotonic()
+                else:
+                    self._remember({name: fst})
+            return fst
+
+    def scan_files(self) -> Iterator[dict[str, FileStat]]:
+        """the whole listing a page at a time, caching each one as it arrives
+
+        once the last page is in the listing counts as one snapshot, every
+        stat in it is kept attr_ttl from then. The getattr the kernel sends
+        for each entry after a readdir is answered from it, however long the
+        listing took to page through
+        """
+        names: list[str] = []
+        for page in self.list_pages():
+            with self.files_lock:
+                self._remember(page)
+            names.extend(page)
+            yield page
+
+        with self.files_lock:
+            now = time.monotonic()
+            for name in names:
+                # unless its been dropped or refreshed since
+                if name in self.fetched:
+                    self.fetched[name] = now
+
+    def _remember(self, page: dict[str, FileStat]):
+        now = time.monotonic()
+        for name, fst in page.items():
+            old = self.files.get(name)
+            # writes through the mount go through the kernel too, so these
+            # only differ when someone else changed the file
+            if old is not None and (old.st_ino, old.st_size) != (
+                fst.st_ino,
+                fst.st_size,
+            ):
+                self.versions[name] = self.versions.get(name, 0) + 1
+            self.files[name] = fst
+            self.fetched[name] = now
+            self.missing.pop(name, None)
+
+    def invalidate(self, name: Optional[str] = None):
+        """forget what we know about `name` (or everything) so the next lookup refreshes"""
+        with self.files_lock:
+            if name is None:
+                self.fetched.clear()
+                self.missing.clear()
+            else:
+                self.fetched.pop(name, None)
+                self.missing.pop(name, None)
+
+    def changed(self, name: str):
+        """someone else changed `name`, drop what we and the kernel have cached"""
+        with self.files_lock:
+            self.versions[name] = self.versions.get(name, 0) + 1
+        self.invalidate(name)
+
+    def forget(self, name: str):
+        """record that `name` was removed without going back to the chain"""
+        # after any lookup already under way, it would bring the file back
+        with self._lookup_lock(name), self.files_lock:
+            self.files.pop(name, None)
+            self.fetched.pop(name, None)
+            self.versions.pop(name, None)
+            self.opened.pop(name, None)
+            self.missing[name] = time.monotonic()
+
     @abstractmethod
     def list_files(self) -> dict[str, FileStat]:
         ...
 
+    def list_pages(self) -> Iterator[dict[str, FileStat]]:
+        """the listing in pages, chains that cant page hand it over in one"""
+        yield self.list_files()
+
+    def find_file(self, name: str) -> Optional[FileStat]:
+        """the stat of `name`, chains that cant look one up list them all"""
+        return self.list_files().get(name)
+
     @abstractmethod
     def create_file(self, name: str):
         ...
@@ -74,6 +242,61 @@ class StorageManager(ABC):
     def delete_file(self, name: str):
         ...
 
+    def rename_file(self, old: str, new: str):
+        """give `old` the name `new`, chains that cant say so and mv copies it instead"""
+        raise OSError(errno.EXDEV, "cant rename on this chain", old)
+
+    def flush_file(self, name: str):
+        """push any writes buffered for `name` to the chain"""
+
+    def sync_file(self, name: str):
+        """flush `name` and wait until the chain has it"""
+        self.flush_file(name)
+
+    def flush_all(self):
+        for name in self.file_names():
+            self.sync_file(name)
+
+    def truncate_file(self, name: str, length: int):
+        """set the length of `name`, chains that cant do it leave the file alone"""
+
+    def open_file(self, name: str, flags: int) -> FileHandle:
+        if not self.file_exists(name):
+            raise FileNotFoundError(errno.ENOENT, "no such file", name)
+        return FileHandle(name, self.file_stat(name), flags)
+
+    def keep_cache(self, name: str) -> bool:
+        """whether pages the kernel cached for `name` are still good, asked on open"""
+        with self.files_lock:
+            version = self.versions.get(name, 0)
+            keep = self.opened.get(name) == version
+            self.opened[name] = version
+            return keep
+
+    def handle_stat(self, fh: FileHandle) -> FileStat:
+        # writes through other handles may have grown the file since open
+        fh.fst = self.files.get(fh.name, fh.fst)
+        return fh.fst
+
+    def read_handle(self, fh: FileHandle, offset: int, size: int) -> bytes:
+        return self.read_file(fh.name, offset, size)
+
+    def write_handle(self, fh: FileHandle, offset: int, buf: bytes) -> int:
+        fh.dirty = True
+        return self.write_file(fh.name, offset, buf)
+
+    def flush_handle(self, fh: FileHandle):
+        if fh.dirty:
+            self.flush_file(fh.name)
+
+    def sync_handle(self, fh: FileHandle):
+        if fh.dirty:
+            self.sync_file(fh.name)
+            fh.dirty = False
+
+    def release_handle(self, fh: FileHandle):
+        self.sync_handle(fh)
+
 
 class NftpFS(Fuse):
     """Nakamoto File Transfer Protocol
@@ -86,9 +309,10 @@ class NftpFS(Fuse):
     def __init__(self, storage_manager: StorageManager, **kwargs):
         super().__init__(**kwargs)
         self.storage_manager = storage_manager
-        logging.debug(
-            f"initialized with filenames: {self.storage_manager.file_names()}"
-        )
+        # fuse only hands open/read/write/etc to the file class for the ops
+        # we dont define ourselves
+        self.file_class = NftpFile.bind(storage_manager)
+        logging.debug(f"initialized with {type(storage_manager).__name__}")
 
     def getattr(self, path: str):
         logging.debug(f"getattr for {path}")
@@ -97,59 +321,38 @@ class NftpFS(Fuse):
             fst = FileStat(0)
             fst.st_mode = stat.S_IFDIR | 0o755
             fst.st_nlink = 2
+            fst.st_ino = 1
             return fst
 
+        fst = None
         if self.storage_manager.file_exists(path[1:]):
             logging.debug("file exists, getting stats")
-            try:
-                fst = self.storage_manager.file_stat(path[1:])
-            except Exception as e:
-                logging.error("getattr exception: " + e.__str__())
-            return fst
-        else:
+            # unless another thread unlinked it since
+            fst = self.storage_manager.files.get(path[1:])
+        if fst is None:
             return -errno.ENOENT
+        return fst
 
     def readdir(self, path: bytes, offset: int):
         logging.debug(f"readdir: {path} {offset}")
 
-        try:
-            fnames = self.storage_manager.file_names()
-        except Exception as e:
-            logging.error("readdir error:" + e.__str__())
-
-        for fname in [".", ".."] + fnames:
-            yield fuse.Direntry(fname)
-
-    def open(self, path: str, flags: int):
-        # TODO: check if allowed based on file perms?
-        logging.debug(f"open: {path}")
-
-        try:
-            ok = self.storage_manager.file_exists(path[1:])
-        except Exception as e:
-            logging.error("open error: " + e.__str__())
-
-        return int(not ok)
-
-    def read(self, path: str, size: int, offset: int) -> bytes:
-        logging.debug(f"read: {path}")
+        for fname in [".", ".."]:
+            yield fuse.Direntry(fname, type=stat.S_IFDIR)
 
+        # entries go out as each page of the listing arrives, with what the
+        # kernel needs to know without a getattr
         try:
-            buf = self.storage_manager.read_file(path[1:], offset, size)
+            for page in self.storage_manager.scan_files():
+                for fname, fst in page.items():
+                    yield fuse.Direntry(
+                        fname, type=stat.S_IFMT(fst.st_mode), ino=fst.st_ino
+                    )
         except Exception as e:
-            logging.error("read error: " + e.__str__())
-
-        return buf
-
-    def write(self, path: str, buf: int, offset: int) -> int:
-        logging.debug(f"write: {path}")
-
-        try:
-            written = self.storage_manager.write_file(path[1:], offset, buf)
-        except Exception as e:
-            logging.error("write error: " + e.__str__())
+            logging.error("readdir error:" + e.__str__())
 
-        return written
+    def fsdestroy(self):
+        logging.debug("fsdestroy")
+        self.storage_manager.flush_all()
 
     def unlink(self, path: str):
         logging.debug(f"unlink: {path}")
@@ -185,8 +388,15 @@ class NftpFS(Fuse):
         return 0
 
     def rename(self, path, path1):
-        logging.debug(f"rename: {path1, path}")
-        return 0
+        logging.debug(f"rename: {path, path1}")
+
+        try:
+            self.storage_manager.rename_file(path[1:], path1[1:])
+        except OSError as e:
+            return -e.errno
+        except Exception as e:
+            logging.error("rename error: " + e.__str__())
+            return -errno.EIO
 
     def link(self, path, path1):
         logging.debug(f"link: {path1, path}")
@@ -202,12 +412,15 @@ class NftpFS(Fuse):
 
     def truncate(self, path, len):
         logging.debug(f"truncate: {path, len}")
-        # f = open("." + path, "a")
-        # f.truncate(len)
-        # f.close()
 
-        # TODO:
-        return 0
+        try:
+            self.storage_manager.truncate_file(path[1:], len)
+        except OSError as e:
+            logging.error("truncate error: " + e.__str__())
+            return -e.errno
+        except Exception as e:
+            logging.error("truncate error: " + e.__str__())
+            return -errno.EIO
 
     def close(self):
         logging.debug("close")
@@ -219,12 +432,8 @@ class NftpFS(Fuse):
     def utime(self, path, times):
         logging.debug(f"utime: {path, times}")
 
-    # def release(self):
-    #    logging.debug("release")
     # def statfs(self):
     #    logging.debug("statfs")
-    # def fsync(self):
-    #    logging.debug("fsync")
     # def create(self):
     #    logging.debug("create")
     # def opendir(self):
@@ -233,12 +442,6 @@ class NftpFS(Fuse):
     #    logging.debug("releasedir")
     # def fsyncdir(self):
     #    logging.debug("fsyncdir")
-    # def flush(self):
-    #    logging.debug("flushdir")
-    # def fgetattr(self):
-    #    logging.debug("fgetattr")
-    # def ftruncate(self):
-    #    logging.debug("ftruncate")
     # def getxattr(self):
     #    logging.debug("getxattr")
     # def listxattr(self):
@@ -255,9 +458,94 @@ class NftpFS(Fuse):
     #    logging.debug("utimens")
     # def bmap(self):
     #    logging.debug("bmap")
-    # def fsdestroy(self):
-    #    logging.debug("fsdestroy")
     # def ioctl(self):
     #    logging.debug("ioctl")
     # def poll(self):
     #    logging.debug("poll")
+
+
+class NftpFile(object):
+    """stateful file for fuse-python's file_class api, one per open
+
+    fuse hands the instance back on every call against the open file so the
+    handle the storage manager gave us on open is reused for all of its I/O
+    """
+
+    storage_manager: StorageManager
+
+    @classmethod
+    def bind(cls, storage_manager: StorageManager) -> type["NftpFile"]:
+        return type(cls.__name__, (cls,), {"storage_manager": storage_manager})
+
+    def __init__(self, path: str, flags: int, *mode):
+        logging.debug(f"open: {path} {flags} {mode}")
+        name = path[1:]
+
+        if flags & os.O_CREAT and not self.storage_manager.file_exists(name):
+            self.storage_manager.create_file(name, *(mode or (0o100644,)), 0)
+
+        self.fh = self.storage_manager.open_file(name, flags)
+        # fuse reads this off us once open returns, false has the kernel
+        # drop whatever it cached for the file
+        self.keep_cache = self.storage_manager.keep_cache(name)
+        if flags & os.O_TRUNC:
+            self.ftruncate(0)
+
+    def read(self, size: int, offset: int) -> bytes:
+        logging.debug(f"read: {self.fh.name} {size} {offset}")
+
+        try:
+            return self.storage_manager.read_handle(self.fh, offset, size)
+        except Exception as e:
+            logging.error("read error: " + e.__str__())
+            return -errno.EIO
+
+    def write(self, buf: bytes, offset: int) -> int:
+        logging.debug(f"write: {self.fh.name} {len(buf)} {offset}")
+
+        try:
+            return self.storage_manager.write_handle(self.fh, offset, buf)
+        except Exception as e:
+            logging.error("write error: " + e.__str__())
+            return -errno.EIO
+
+    def flush(self):
+        logging.debug(f"flush: {self.fh.name}")
+
+        try:
+            self.storage_manager.flush_handle(self.fh)
+        except Exception as e:
+            logging.error("flush error: " + e.__str__())
+            return -errno.EIO
+
+    def fsync(self, isfsyncfile: bool):
+        logging.debug(f"fsync: {self.fh.name}")
+
+        try:
+            self.storage_manager.sync_handle(self.fh)
+        except Exception as e:
+            logging.error("fsync error: " + e.__str__())
+            return -errno.EIO
+
+    def release(self, flags: int):
+        logging.debug(f"release: {self.fh.name}")
+
+        try:
+            self.storage_manager.release_handle(self.fh)
+        except Exception as e:
+            logging.error("release error: " + e.__str__())
+            return -errno.EIO
+
+    def fgetattr(self):
+        logging.debug(f"fgetattr: {self.fh.name}")
+        return self.storage_manager.handle_stat(self.fh)
+
+    def ftruncate(self, len: int):
+        logging.debug(f"ftruncate: {self.fh.name} {len}")
+
+        try:
+            self.fh.dirty = True
+            self.storage_manager.truncate_file(self.fh.name, len)
+        except Exception as e:
+            logging.error("ftruncate error: " + e.__str__())
+            return -errno.EIO
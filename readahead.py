@@ -0,0 +1,55 @@
+import math
+import time
+from threading import Lock
+
+
+class ReadAhead:
+    """per file access pattern tracker that sizes the prefetch window
+
+    reads that pick up where the last one stopped (or start at 0) are treated
+    as a stream. The window is the number of blocks the reader gets through, at
+    its observed rate, in the time it takes us to fetch one block, bounded to
+    [min_blocks, max_blocks]. Anything else resets the stream.
+    """
+
+    def __init__(self, block_size: int, min_blocks: int = 4, max_blocks: int = 64):
+        self.block_size = block_size
+        self.min_blocks = min_blocks
+        self.max_blocks = max_blocks
+
+        self.next_offset = 0
+        self.last_read = 0.0
+        # bytes/s the reader is consuming, smoothed
+        self.rate = 0.0
+        self.sequential = False
+        # a handle can be read from several fuse threads at once
+        self.lock = Lock()
+
+    def observe(self, offset: int, size: int, fetch_latency: float) -> int:
+        """record a read and return how many blocks past it should be prefetched"""
+        with self.lock:
+            return self._observe(offset, size, fetch_latency)
+
+    def _observe(self, offset: int, size: int, fetch_latency: float) -> int:
+        now = time.monotonic()
+
+        if offset == self.next_offset and self.sequential:
+            elapsed = now - self.last_read
+            if elapsed > 0:
+                rate = size / elapsed
+                self.rate = rate if self.rate == 0 else 0.75 * self.rate + 0.25 * rate
+        else:
+            self.sequential = offset == self.next_offset or offset == 0
+            self.rate = 0.0
+
+        self.next_offset = offset + size
+        self.last_read = now
+
+        if not self.sequential or self.max_blocks == 0:
+            return 0
+
+        if self.rate == 0 or fetch_latency == 0:
+            return min(self.min_blocks, self.max_blocks)
+
+        window = math.ceil(self.rate * fetch_latency / self.block_size)
+        return max(self.min_blocks, min(self.max_blocks, window))
@@ -0,0 +1,87 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+
+from algorand.fake_algod import FakeAlgod
+
+
+class StandIn(ThreadingHTTPServer):
+    """a bare keep-alive HTTP server answering every GET with some json
+
+    `mode` picks how the body goes out, "length" with a Content-Length,
+    "chunked" or "eof" closing the connection after it. With `hang_up` set the
+    next response quietly closes its connection, the way a server drops an
+    idle keep-alive one
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.mode = "length"
+        self.hang_up = False
+        self.connections = 0
+        self.requests = 0
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StandIn
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        out = json.dumps({"path": self.path, "pad": "x" * 5000}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        mode = self.server.mode
+        if mode == "chunked":
+            self.send_header("Transfer-Encoding", "chunked")
+        elif mode == "length":
+            self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+
+        if mode == "chunked":
+            for start in range(0, len(out), 1000):
+                chunk = out[start : start + 1000]
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.wfile.write(out)
+
+        if mode == "eof" or self.server.hang_up:
+            self.server.hang_up = False
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in() -> Iterator[StandIn]:
+    server = StandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake() -> Iterator[FakeAlgod]:
+    """a FakeAlgod served over HTTP, so the real transports carry every request"""
+    fake = FakeAlgod()
+    fake.serve()
+    yield fake
+    assert fake.server is not None
+    fake.server.shutdown()
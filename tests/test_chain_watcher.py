@@ -0,0 +1,34 @@
+import errno
+import os
+import time
+
+from algorand.fake_algod import FakeAlgod
+from algorand_storage_manager import WATCHED_TTL, AlgorandStorageManager
+from nftp import NftpFS
+
+
+def settle(cond, what: str):
+    for _ in range(300):
+        if cond():
+            return
+        time.sleep(0.01)
+    raise AssertionError(what)
+
+
+def test_stats_only_kept_longer_while_following(fake: FakeAlgod):
+    app_client = fake.create_app_client()
+    fake.fail_next("status")
+    watched = AlgorandStorageManager(
+        app_client, writeback_age=0, attr_ttl=0, negative_ttl=0, watch_chain=True
+    )
+    fs = NftpFS(storage_manager=watched)
+    # the first status read failed, until its retried nothing is followed
+    assert watched.negative_ttl == 0
+    assert fs.getattr("/y") == -errno.ENOENT
+
+    other = NftpFS(storage_manager=AlgorandStorageManager(app_client))
+    other.file_class("/y", os.O_WRONLY | os.O_CREAT, 0o100644).release(0)
+    assert fs.getattr("/y").st_size == 0
+
+    settle(lambda: watched.attr_ttl == WATCHED_TTL, "never followed rounds")
+    assert watched.index.ttl == WATCHED_TTL
@@ -0,0 +1,217 @@
+import errno
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from beaker.client import ApplicationClient
+
+from algorand.contract import NFTP
+from algorand.fake_algod import FakeAlgod
+from algorand.file_index import APP
+from algorand_storage_manager import AlgorandStorageManager, check_app
+from nftp import NftpFS
+
+
+def test_round_trip(fake: FakeAlgod):
+    manager = AlgorandStorageManager(fake.create_app_client(), writeback_age=0)
+    fs = NftpFS(storage_manager=manager)
+    data = random.Random(1).randbytes(5000)
+
+    f = fs.file_class("/f", os.O_WRONLY | os.O_CREAT, 0o100644)
+    for off in range(0, len(data), 4096):
+        assert f.write(data[off : off + 4096], off) == len(data[off : off + 4096])
+    f.fsync(False)
+    f.release(0)
+
+    # a second mount has nothing cached, everything comes off chain
+    other = NftpFS(storage_manager=AlgorandStorageManager(manager.app_client))
+    assert other.getattr("/f").st_size == len(data)
+    assert other.file_class("/f", os.O_RDONLY).read(len(data), 0) == data
+    assert [e.name for e in other.readdir("/", 0)] == [".", "..", "f"]
+
+
+def test_lookups_run_in_parallel(fake: FakeAlgod):
+    manager = AlgorandStorageManager(
+        fake.create_app_client(), attr_ttl=0, negative_ttl=0
+    )
+    fs = NftpFS(storage_manager=manager)
+    names = [f"/f{i}" for i in range(8)]
+    for name in names:
+        manager.create_file(name[1:], 0o100644, 0)
+
+    fake.rtt = 0.1
+    start = time.monotonic()
+    with ThreadPoolExecutor(2 * len(names)) as pool:
+        stats = list(pool.map(fs.getattr, names + names))
+    elapsed = time.monotonic() - start
+
+    assert all(fst.st_size == 0 for fst in stats)
+    # one round trip after another would take 1.6s
+    assert elapsed < 0.8
+
+
+def test_failed_create_gives_back_its_slot(fake: FakeAlgod):
+    manager = AlgorandStorageManager(fake.create_app_client())
+    for i in range(5):
+        fake.fail_next("send")
+        with pytest.raises(Exception):
+            manager.create_file(f"f{i}", 0o100644, 0)
+
+    assert not manager.index.listed.get(APP)
+    manager.create_file("f", 0o100644, 0)
+    assert manager.index.where[b"/f"] is APP
+
+
+def test_block_size_checked_against_the_app(fake: FakeAlgod):
+    app_id = fake.create_app_client(block_size=1024).app_id
+    client = fake.get_algod_client()
+
+    check_app(ApplicationClient(client, NFTP(block_size=1024), app_id=app_id))
+    for block_size in (512, 1778):
+        with pytest.raises(ValueError):
+            check_app(
+                ApplicationClient(client, NFTP(block_size=block_size), app_id=app_id)
+            )
+
+
+def test_file_unlinked_after_its_looked_up(fake: FakeAlgod):
+    manager = AlgorandStorageManager(fake.create_app_client(), writeback_age=0)
+    fs = NftpFS(storage_manager=manager)
+    for name in ("a", "b", "c"):
+        manager.create_file(name, 0o100644, 0)
+
+    # another thread unlinks each file right after its found
+    exists = manager.file_exists
+    unlink = {"a", "b", "c"}
+
+    def unlinked_after(name: str) -> bool:
+        found = exists(name)
+        if name in unlink:
+            unlink.remove(name)
+            manager.delete_file(name)
+        return found
+
+    manager.file_exists = unlinked_after  # type: ignore[method-assign]
+    assert fs.getattr("/a") == -errno.ENOENT
+    with pytest.raises(FileNotFoundError):
+        manager.read_file("b", 0, 10)
+    assert fs.truncate("/c", 10) == -errno.ENOENT
+
+
+def test_flush_all_goes_on_past_a_failed_file(fake: FakeAlgod):
+    manager = AlgorandStorageManager(fake.create_app_client(), writeback_age=0)
+    fs = NftpFS(storage_manager=manager)
+    names = [f"f{i}" for i in range(4)]
+    for name in names:
+        manager.create_file(name, 0o100644, 0)
+        manager.write_file(name, 0, name.encode() * 100)
+
+    fake.fail_next("send")
+    with pytest.raises(Exception):
+        manager.flush_all()
+    # whichever file failed still has its blocks buffered, the rest made it
+    failed = {name for name, blocks in manager.dirty.items() if blocks}
+    assert len(failed) == 1
+
+    other = AlgorandStorageManager(manager.app_client)
+    for name in set(names) - failed:
+        assert other.read_file(name, 0, 1000) == name.encode() * 100
+
+
+def test_nuls_read_back_exactly(fake: FakeAlgod):
+    manager = AlgorandStorageManager(fake.create_app_client(), writeback_age=0)
+    fs = NftpFS(storage_manager=manager)
+    size = manager.storage_size
+    # zeros at both ends, and whole blocks of them inside
+    data = bytes(100) + random.Random(2).randbytes(size) + bytes(2 * size) + b"x"
+    data += bytes(size + 50)
+
+    f = fs.file_class("/z", os.O_WRONLY | os.O_CREAT, 0o100644)
+    f.write(data, 0)
+    f.fsync(False)
+    f.release(0)
+
+    other = AlgorandStorageManager(manager.app_client)
+    ofs = NftpFS(storage_manager=other)
+    assert ofs.getattr("/z").st_size == len(data)
+    r = ofs.file_class("/z", os.O_RDONLY)
+    assert r.read(len(data) + 100, 0) == data
+    assert r.read(10, len(data) - 10) == bytes(10)
+    # nothing at or past the end, and nothing when asked for nothing
+    assert r.read(10, len(data)) == b""
+    assert r.read(10, len(data) + 5) == b""
+    for offset in (0, size, 10):
+        assert other.read_file("z", offset, 0) == b""
+        assert r.read(0, offset) == b""
+
+
+def test_rename(fake: FakeAlgod):
+    manager = AlgorandStorageManager(fake.create_app_client(), writeback_age=0)
+    fs = NftpFS(storage_manager=manager)
+    size = manager.storage_size
+    written = {}
+    for path, data in [
+        ("/a", b"a" * (size + 10)),
+        ("/doc", b"old" * 100),
+        ("/.doc.swp", random.Random(3).randbytes(2 * size)),
+    ]:
+        f = fs.file_class(path, os.O_WRONLY | os.O_CREAT, 0o100644)
+        f.write(data, 0)
+        f.release(0)
+        written[path] = (data, fs.getattr(path).st_ino)
+
+    # a plain rename, then the way an editor saves, over the file it replaces
+    assert not fs.rename("/a", "/b")
+    assert not fs.rename("/.doc.swp", "/doc")
+
+    cold = NftpFS(storage_manager=AlgorandStorageManager(manager.app_client))
+    for mount in (fs, cold):
+        for old, new in [("/a", "/b"), ("/.doc.swp", "/doc")]:
+            data, ino = written[old]
+            assert mount.getattr(old) == -errno.ENOENT
+            fst = mount.getattr(new)
+            assert (fst.st_ino, fst.st_size) == (ino, len(data))
+            assert mount.file_class(new, os.O_RDONLY).read(len(data) + 10, 0) == data
+        assert sorted(e.name for e in mount.readdir("/", 0)) == [".", "..", "b", "doc"]
+
+
+def test_sparse_file(fake: FakeAlgod):
+    manager = AlgorandStorageManager(fake.create_app_client(), writeback_age=0)
+    fs = NftpFS(storage_manager=manager)
+    size = manager.storage_size
+    length = 6 * size
+
+    # preallocated the way cp --sparse or a download does, then both ends written
+    f = fs.file_class("/s", os.O_WRONLY | os.O_CREAT, 0o100644)
+    assert not f.ftruncate(length)
+    f.write(b"head", 0)
+    f.write(b"tail", length - 4)
+    f.fsync(False)
+    f.release(0)
+    data = b"head" + bytes(length - 8) + b"tail"
+
+    fst = fs.getattr("/s")
+    assert (fst.st_size, fst.num_boxes, fst.num_stored) == (length, 6, 2)
+    r = fs.file_class("/s", os.O_RDONLY)
+    assert r.read(length, 0) == data
+    assert r.read(size, 2 * size) == bytes(size)
+
+    # another mount only learns where the holes are as its reads 404
+    other = AlgorandStorageManager(manager.app_client)
+    ofs = NftpFS(storage_manager=other)
+    assert ofs.getattr("/s").num_stored == 2
+    r = ofs.file_class("/s", os.O_RDWR)
+    assert r.read(10, 3 * size) == bytes(10)
+    assert r.read(length, 0) == data
+    assert other.unprovisioned["s"] == {1, 2, 3, 4}
+
+    # filling in a hole it found gives it a storage account, the rest stay holes
+    r.write(b"middle", 3 * size)
+    r.fsync(False)
+    r.release(0)
+    data = data[: 3 * size] + b"middle" + data[3 * size + 6 :]
+    cold = NftpFS(storage_manager=AlgorandStorageManager(manager.app_client))
+    assert cold.getattr("/s").num_stored == 3
+    assert cold.file_class("/s", os.O_RDONLY).read(length, 0) == data
@@ -0,0 +1,58 @@
+from typing import Any, Callable
+
+import pytest
+
+from algorand.transport import (
+    AsyncAlgodClient,
+    EventLoopThread,
+    PooledAlgodClient,
+    async_client_for,
+)
+
+TOKEN = "a" * 64
+
+
+@pytest.fixture(scope="module")
+def io() -> EventLoopThread:
+    return EventLoopThread()
+
+
+@pytest.fixture(params=["pooled", "async"])
+def get(request, stand_in, io) -> Callable[[str], Any]:
+    """GET a path from the stand in with one of the two transports"""
+    if request.param == "pooled":
+        client = PooledAlgodClient(TOKEN, stand_in.address)
+        return lambda path: client.algod_request("GET", path)
+
+    aclient = AsyncAlgodClient(TOKEN, stand_in.address)
+    return lambda path: io.run(aclient.request("GET", path))
+
+
+def test_keep_alive_reuses_the_connection(stand_in, get):
+    for i in range(5):
+        assert get(f"/status/{i}")["path"] == f"/v2/status/{i}"
+    assert stand_in.connections == 1
+
+
+def test_reconnects_after_server_close(stand_in, get):
+    stand_in.hang_up = True
+    get("/status")
+    # the connection we kept was closed under us, its tried again on a new one
+    assert get("/status")["path"] == "/v2/status"
+    assert stand_in.connections == 2
+
+
+@pytest.mark.parametrize("mode", ["length", "chunked", "eof"])
+def test_response_bodies(stand_in, get, mode):
+    stand_in.mode = mode
+    for _ in range(2):
+        body = get("/status")
+        assert body["pad"] == "x" * 5000
+    # only a body running to eof costs the connection
+    assert stand_in.connections == (2 if mode == "eof" else 1)
+
+
+def test_async_pool_size_is_its_own(stand_in):
+    client = PooledAlgodClient(TOKEN, stand_in.address, pool_size=2)
+    assert async_client_for(client, 12).pool_size == 12
+    assert client.async_client().pool_size == 2